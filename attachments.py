@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import io
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image, ImageSequence
+
+
+class ImageRejected(Exception):
+    """Raised with a user-facing reason when an attachment can't be used."""
+
+
+@dataclass
+class Animation:
+    frames: list
+    durations: list
+    loop: int
+    format: str
+
+
+class SourceCache:
+    """Decoded source images and the digests of their files by attachment
+    id, kept for `ttl` seconds so several commands replying to the same
+    image only fetch it once. Least
+    recently used images are dropped once they hold over `max_bytes` of
+    pixels; an image bigger than that on its own is never kept."""
+
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        entry = self._images.get(key)
+        if entry is None:
+            return None
+        expires, img, digest, size = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._images.move_to_end(key)
+        return img, digest
+
+    def put(self, key, img, digest):
+        size = pixel_bytes(img)
+        if key in self._images:
+            self._drop(key)
+        if size > self.max_bytes:
+            return
+        self._images[key] = (time.monotonic() + self.ttl, img, digest, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._images)))
+
+    def _drop(self, key):
+        self._bytes -= self._images.pop(key)[3]
+
+
+def pixel_bytes(img):
+    """Memory held by the pixels of an image or every frame of an Animation."""
+    frames = img.frames if isinstance(img, Animation) else [img]
+    return sum(frame.width * frame.height * len(frame.getbands()) for frame in frames)
+
+
+def decode(data, max_pixels, working_size, max_frames=1, max_animation_pixels=0):
+    """Decode image bytes to RGB no larger than `working_size` on either side.
+
+    Only the header is read before the pixel limit is checked. JPEGs are
+    decoded straight at a reduced scale when they are larger than needed.
+    Animated images come back as an Animation, with frames scaled down
+    further if needed to fit `max_animation_pixels` in total.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        raise ImageRejected(f"That image is too large, the limit is {max_pixels:,} pixels.")
+    except (Image.UnidentifiedImageError, OSError):
+        raise ImageRejected("That attachment isn't an image I can read.")
+
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageRejected(f"That image is {width}x{height}, the limit is {max_pixels:,} pixels.")
+
+    if getattr(img, "is_animated", False):
+        return decode_animation(img, working_size, max_frames, max_animation_pixels)
+
+    if max(width, height) > working_size:
+        ratio = working_size / max(width, height)
+        img.draft("RGB", (math.ceil(width * ratio), math.ceil(height * ratio)))
+    img = img.convert("RGB")
+    if max(img.size) > working_size:
+        img.thumbnail((working_size, working_size))
+    return img
+
+
+def decode_animation(img, working_size, max_frames, max_pixels):
+    count = img.n_frames
+    if count > max_frames:
+        raise ImageRejected(f"That animation has {count} frames, the limit is {max_frames}.")
+
+    width, height = img.size
+    ratio = min(1, working_size / max(width, height), (max_pixels / (count * width * height)) ** 0.5)
+    size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(img):
+        frames.append(frame.convert("RGB").resize(size) if ratio < 1 else frame.convert("RGB"))
+        durations.append(frame.info.get("duration", 100))
+    return Animation(frames, durations, img.info.get("loop", 0), "WEBP" if img.format == "WEBP" else "GIF")
+
+
+def load(data, *args):
+    """decode(data, *args) and the SHA-256 of the file, which identifies the
+    image far more cheaply than its decoded pixels."""
+    return decode(data, *args), hashlib.sha256(data).hexdigest()
+
+
+async def fetch_image(attachment, cache, max_bytes, max_pixels, working_size, max_frames=1, max_animation_pixels=0):
+    """Return the attachment's decoded image and the digest of its file."""
+    cached = cache.get(attachment.id)
+    if cached is not None:
+        return cached
+
+    if attachment.size > max_bytes:
+        raise ImageRejected(f"That file is {attachment.size / 2**20:.1f} MB, the limit is {max_bytes / 2**20:.1f} MB.")
+    data = await attachment.read()
+    img, digest = await asyncio.to_thread(load, data, max_pixels, working_size, max_frames, max_animation_pixels)
+    cache.put(attachment.id, img, digest)
+    return img, digest
@@ -0,0 +1,166 @@
+"""Benchmark every registered generator and effect against a stored baseline.
+
+    python bench.py                         run everything, compare to the baseline
+    python bench.py --save                  record the results as the new baseline
+    python bench.py --modes mandelbrot blur --sizes 64 256
+
+Each mode runs at every size with its default parameters, then once more for
+each of its key parameters at HEAVY_FACTOR times the default (clamped to the
+parameter's bounds). Effects run on a seeded plasma image of the same size.
+Every case runs in a fresh forked process so its peak memory can be measured
+on its own. The exit status is 1 if any case regressed or failed.
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import encoding
+import ifs
+import images
+from lazy import LazyModule
+
+SIZES = (64, 128, 256, 512, 1024)
+KEY_PARAMS = ("max_iter", "iterations", "scale", "radius", "octaves")
+HEAVY_FACTOR = 10
+REPEAT = 3
+BASELINE_FILE = "bench_baseline.json"
+
+# Arguments for modes that can't run, or do nothing, on their defaults alone.
+REQUIRED_ARGS = {
+    "ifs": {"maps": ifs.BARNSLEY_FERN, "weights": ifs.BARNSLEY_FERN_WEIGHTS},
+    "resize": {"width": 512},
+}
+
+# A case regresses when a measurement grows by more than TOLERANCE over the
+# baseline and by more than its noise floor.
+TOLERANCE = 0.25
+NOISE = {"seconds": 0.005, "peak_kib": 8192, "bytes": 1024}
+
+
+def cases(modes=None, sizes=SIZES):
+    """Yield (case id, kind, mode, size, kwargs) for every registered mode."""
+    for kind, registry in (("generate", images.IMAGE_GENERATORS), ("effect", images.IMAGE_EFFECTS)):
+        for mode, func in sorted(registry.items()):
+            if modes and mode not in modes:
+                continue
+            required = REQUIRED_ARGS.get(mode, {})
+            defaults, _ = func.params.normalize(required)
+            variants = [{}]
+            for name in KEY_PARAMS:
+                if defaults.get(name) is not None:
+                    variants.append({name: defaults[name] * HEAVY_FACTOR})
+            variants = [{**required, **variant} for variant in variants]
+            if func.seeded:
+                variants = [{**variant, "seed": 0} for variant in variants]
+            for size in sizes:
+                for variant in variants:
+                    kwargs, _ = func.params.normalize(variant)
+                    label = " ".join(f"{k}={kwargs[k]}" for k in variant if k not in required and k != "seed") or "default"
+                    yield f"{kind} {mode} {size} {label}", kind, mode, size, kwargs
+
+
+def _rss_kib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def run_case(kind, mode, size, kwargs, repeat):
+    """Best wall time of `repeat` runs, peak memory above what the process
+    held beforehand, and the size of the output as a PNG."""
+    if kind == "effect":
+        source = images.IMAGE_GENERATORS["plasma"](size, size, seed=0)
+        run = lambda: images.apply_effects(source, [(mode, kwargs)])
+    else:
+        func = images.IMAGE_GENERATORS[mode]
+        run = lambda: func(size, size, **kwargs)
+    start_kib = _rss_kib()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        img = run()
+        times.append(time.perf_counter() - start)
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_kib
+    return {"seconds": min(times), "peak_kib": max(peak_kib, 0), "bytes": len(encoding.encode(img))}
+
+
+def compare(result, base, tolerance):
+    """Names of the measurements in `result` that regressed from `base`."""
+    return [name for name, noise in NOISE.items()
+            if result[name] > base[name] * (1 + tolerance) and result[name] - base[name] > noise]
+
+
+def environment():
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image generators and effects.")
+    parser.add_argument("--modes", nargs="+", help="only these generators and effects")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="write the results into the baseline")
+    args = parser.parse_args()
+    # Import what the plugins would load lazily now, so that every case
+    # measures rendering rather than imports.
+    for plugin in images.load_plugins():
+        for value in vars(plugin).values():
+            if isinstance(value, LazyModule):
+                importlib.import_module(value.__name__)
+
+    baseline = {"environment": environment(), "cases": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["environment"] != environment():
+            print(f"warning: the baseline was recorded on {baseline['environment']}", file=sys.stderr)
+    elif not args.save:
+        print(f"no baseline at {args.baseline}; run with --save to record one", file=sys.stderr)
+
+    regressions = []
+    failures = []
+    results = {}
+    context = multiprocessing.get_context("fork")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for case, kind, mode, size, kwargs in cases(args.modes, args.sizes):
+            try:
+                result = results[case] = pool.apply(run_case, (kind, mode, size, kwargs, args.repeat))
+            except Exception as e:
+                failures.append(case)
+                print(f"{case:<52} FAILED: {e!r}", flush=True)
+                continue
+            line = (f"{case:<52} {result['seconds'] * 1000:9.1f} ms {result['peak_kib'] / 1024:8.1f} MiB"
+                    f" {result['bytes'] / 1024:8.1f} KiB")
+            base = baseline["cases"].get(case)
+            if base is None:
+                line += "  new"
+            else:
+                line += f"  {(result['seconds'] / max(base['seconds'], 1e-9) - 1) * 100:+5.0f}%"
+                worse = compare(result, base, args.tolerance)
+                if worse:
+                    regressions.append(case)
+                    line += "  REGRESSED: " + ", ".join(worse)
+            print(line, flush=True)
+
+    if args.save:
+        baseline["environment"] = environment()
+        baseline["cases"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"saved {len(results)} cases to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} of {len(results)} cases regressed", file=sys.stderr)
+    if failures:
+        print(f"{len(failures)} cases failed", file=sys.stderr)
+    return 1 if failures or (regressions and not args.save) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,30 @@
-from discord.ext import commands
-from PIL import Image, ImageOps, ImageFilter, ImageEnhance, ImageDraw
+from discord.ext import commands, tasks
 import discord
-import json
 import os
 import io
 import datetime
 import difflib
-import math
-import random
-import numpy as np
+import re
+import time
+import asyncio
+import collections
+import contextlib
+import textwrap
+import typing
+import attachments
+import calculator
+import encoding
+import scheduler
+import metrics
+import parameters
+import storage
+import splog
+from images import (IMAGE_EFFECTS, IMAGE_GENERATORS, apply_effects, apply_effects_frames, code_version, help_text,
+                    load_plugins, reload_plugins, render_encoded, save_animation)
+from parameters import Param, Schema
+from ranks import RankIndex
+from rendercache import RenderCache, make_key
+from workers import WorkerPool
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -16,36 +32,355 @@ intents.members = True
 
 bot = commands.Bot(command_prefix="s9k ", intents=intents, owner_id=939268122668584970)
 
-DB_FILE = 'data.json'
+DB_FILE = 'data.db'
+LEGACY_DB_FILE = 'data.json'
 LOG_FILE = "log.log"
-
-IMAGE_GENERATORS = {}
-IMAGE_EFFECTS = {}
+LOG_QUERY_CHARS = 1900
+HELP_CHUNK_CHARS = 1900
+
+# New users are written to the database in batches, at least every
+# USER_FLUSH_INTERVAL seconds and on a clean shutdown; a crash loses those
+# added since the last flush. Point grants are written before they are
+# confirmed.
+USER_FLUSH_INTERVAL = 30
+
+# Event loop lag is sampled every LOOP_LAG_INTERVAL seconds. Set METRICS_PORT
+# to serve all metrics in Prometheus text format at localhost:PORT/metrics,
+# and METRICS_FILE to write them there every METRICS_DUMP_INTERVAL seconds.
+LOOP_LAG_INTERVAL = 1
+METRICS_PORT = None
+METRICS_FILE = None
+METRICS_DUMP_INTERVAL = 60
+
+RENDER_WORKERS = os.cpu_count()
+RENDER_TIMEOUT = 60
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DIR = "render_cache"
+RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Upload limit outside guilds; in a guild its own (possibly boosted) limit is used.
+DISCORD_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_WORKING_SIZE = 2048
+SOURCE_CACHE_TTL = 300
+SOURCE_CACHE_BYTES = 128 * 1024 * 1024
+# Animated attachments are capped by frame count, and their frames are scaled
+# down until all of them together fit in ANIMATION_MAX_PIXELS.
+ANIMATION_MAX_FRAMES = 200
+ANIMATION_MAX_PIXELS = 32_000_000
+
+# calc runs in its own worker so it never waits behind renders, and is
+# killed if it takes longer than CALC_TIMEOUT seconds.
+CALC_TIMEOUT = 5
+
+# Renders are admitted by estimated cost, roughly pixels x iterations (so a
+# 1024x1024 fractal at max_iter=1000 is about 1e9, with other modes scaled
+# to take about as long per unit), against these budgets for
+# everything running at once, per user and per guild.
+RENDER_BUDGET = 4_000_000_000
+RENDER_USER_BUDGET = 1_000_000_000
+RENDER_GUILD_BUDGET = 2_000_000_000
+
+# Status messages show render progress, edited at most this often (seconds).
+# Reacting with CANCEL_EMOJI on one cancels the render, as does `image cancel`.
+PROGRESS_EDIT_INTERVAL = 2
+CANCEL_EMOJI = "❌"
+
+# `image animate` limits: frames x width x height must fit ANIMATE_MAX_PIXELS,
+# and one request renders at most ANIMATE_WINDOW frames at a time so the
+# rest of the pool stays free for other commands.
+ANIMATE_MAX_FRAMES = 120
+ANIMATE_MAX_PIXELS = 16_000_000
+ANIMATE_WINDOW = max(1, (RENDER_WORKERS or 1) // 2)
+ANIMATION_FORMATS = {"gif": ("GIF", "gif"), "webp": ("WEBP", "webp"), "apng": ("PNG", "png")}
+SWEEP = re.compile(r"^([-+\d.e]+):([-+\d.e]+)(:log)?$")
+
+OUTPUT_PARAMS = Schema({
+    "format": Param(str, default="png", choices=encoding.FORMATS),
+    "quality": Param(int, 1, 100, default=None),
+    "compress": Param(int, 0, 9, default=None),
+})
+ANIMATE_PARAMS = Schema({
+    "frames": Param(int, 2, ANIMATE_MAX_FRAMES, default=24),
+    "duration": Param(int, 20, 10_000, default=100),
+    "format": Param(str, default="gif", choices=tuple(ANIMATION_FORMATS)),
+})
+LEADERBOARD_PARAMS = Schema({"page": Param(int, 1, default=1)})
+
+rank_index = RankIndex()
+
+load_plugins()
+
+render_pool = WorkerPool(RENDER_WORKERS, timeout=RENDER_TIMEOUT)
+calc_pool = WorkerPool(1, timeout=CALC_TIMEOUT)
+render_scheduler = scheduler.Scheduler(RENDER_BUDGET, RENDER_USER_BUDGET, RENDER_GUILD_BUDGET)
+render_cache = RenderCache(RENDER_CACHE_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DISK_BYTES)
+source_cache = attachments.SourceCache(SOURCE_CACHE_TTL, SOURCE_CACHE_BYTES)
+running_renders = {}
+bot_metrics = metrics.Metrics("servo9k")
 
 # === Other Functions ===
 
 def parse_kwargs(args):
-    kwargs = {}
-    for arg in args:
-        if "=" in arg:
-            k, v = arg.split("=", 1)
-            try:
-                kwargs[k] = eval(v, {"__builtins": {}})
-            except:
-                kwargs[k] = v
-    return kwargs
-
-def register_generator(name):
-    def decorator(func):
-        IMAGE_GENERATORS[name] = func
-        return func
-    return decorator
-
-def register_effect(name):
-    def decorator(func):
-        IMAGE_EFFECTS[name] = func
-        return func
-    return decorator
+    """Collect `key=value` arguments as strings; a Schema gives them types."""
+    return dict(arg.split("=", 1) for arg in args if "=" in arg)
+
+def pop_options(kwargs, schema):
+    """Pop the keys of `schema` out of kwargs and normalize them."""
+    options, _ = schema.normalize({k: kwargs.pop(k) for k in schema.params if k in kwargs})
+    return options
+
+class RenderCancelled(Exception):
+    pass
+
+def output_options(ctx, kwargs):
+    """Pop the output encoding options out of a command's kwargs."""
+    output = pop_options(kwargs, OUTPUT_PARAMS)
+    if output["format"] == "auto":
+        output["limit"] = ctx.guild.filesize_limit if ctx.guild else DISCORD_UPLOAD_LIMIT
+    return output
+
+def animation_output(anim, output, format_given):
+    """The format and save_animation options for an animated effect result,
+    and a note if the requested format can't animate. Without a format=
+    the animation keeps its own."""
+    asked = output["format"] if format_given else None
+    format = {"png": "PNG", "webp": "WEBP"}.get(asked, anim.format)
+    note = f"JPEG can't hold an animation, so this is a {anim.format}." if asked == "jpeg" else None
+    return format, {"quality": output["quality"], "compress": output["compress"]}, note
+
+def repeatable(func, kwargs):
+    # Only cache renders that will come out the same every time.
+    return func.cacheable and not (func.seeded and kwargs.get("seed") is None)
+
+def render_key(func, args, kwargs):
+    if not repeatable(func, kwargs):
+        return None
+    return make_key(f"{func.__module__}.{func.__qualname__}@{code_version()}", args, kwargs)
+
+def effects_key(img, digest, stages, output=None):
+    # The source is known by the digest of its file; its decoded size is
+    # added since that depends on the working size limits.
+    if not all(repeatable(IMAGE_EFFECTS[mode], kwargs) for mode, kwargs in stages):
+        return None
+    frames = img.frames if isinstance(img, attachments.Animation) else [img]
+    source = (digest, len(frames), frames[0].size)
+    return make_key(f"effects@{code_version()}", (source, *((mode, sorted(kwargs.items())) for mode, kwargs in stages)), output or {})
+
+@contextlib.asynccontextmanager
+async def render_slot(ctx, status, cost):
+    """Wait for the scheduler to admit a job of `cost` for this user,
+    showing the queue position on the `status` message meanwhile."""
+    text = status.content
+    queued = False
+
+    async def on_wait(position):
+        nonlocal queued
+        queued = True
+        await status.edit(content=f"Queued, position {position}...")
+
+    guild = ctx.guild.id if ctx.guild else None
+    start = time.perf_counter()
+    async with render_scheduler.slot(ctx.author.id, guild, cost, on_wait):
+        bot_metrics.observe("queue_wait", time.perf_counter() - start)
+        if queued:
+            await status.edit(content=text)
+        yield
+
+@contextlib.asynccontextmanager
+async def progress_updates(status):
+    """Yield a progress callback that shows the percentage done on the
+    `status` message, edited at most every PROGRESS_EDIT_INTERVAL seconds."""
+    text = status.content
+    latest = None
+
+    def report(fraction):
+        nonlocal latest
+        latest = fraction
+
+    async def update():
+        shown = None
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            if latest is not None and latest != shown:
+                shown = latest
+                await status.edit(content=f"{text} {shown:.0%}")
+
+    task = asyncio.create_task(update())
+    try:
+        yield report
+    finally:
+        task.cancel()
+
+async def cancellable(ctx, status, coro):
+    """Run `coro` as a task the author can cancel by reacting with
+    CANCEL_EMOJI on `status` or with `s9k image cancel`. Raises
+    RenderCancelled if they do."""
+    task = asyncio.ensure_future(coro)
+    running_renders.setdefault(ctx.author.id, set()).add(task)
+
+    def check(payload):
+        return (payload.message_id == status.id and payload.user_id == ctx.author.id
+                and str(payload.emoji) == CANCEL_EMOJI)
+
+    watcher = asyncio.ensure_future(bot.wait_for("raw_reaction_add", check=check))
+    watcher.add_done_callback(lambda _: task.cancel())
+    try:
+        with contextlib.suppress(discord.HTTPException):
+            await status.add_reaction(CANCEL_EMOJI)
+        # wait() doesn't cancel the task if this command is cancelled, so do it below.
+        await asyncio.wait({task})
+    finally:
+        watcher.cancel()
+        task.cancel()
+        running_renders[ctx.author.id].discard(task)
+        if not running_renders[ctx.author.id]:
+            del running_renders[ctx.author.id]
+    if task.cancelled():
+        raise RenderCancelled()
+    return task.result()
+
+async def render(func, args, kwargs=None, key=None, output=None, slot=None, progress=None):
+    """Render `func` on the worker pool and return the encoded image,
+    PNG unless `output` says otherwise. Cache misses wait for `slot`, and
+    `progress` receives the job's progress if it reports any."""
+    if key:
+        data = await render_cache.get(key)
+        if data is not None:
+            return data
+
+    output = output or {}
+    async with slot or contextlib.nullcontext():
+        data, render_seconds, encode_seconds = await render_pool.run(
+            render_encoded, (output, func, *args), kwargs or {}, progress=progress)
+    bot_metrics.observe("render", render_seconds, mode=func.__name__)
+    bot_metrics.observe("encode", encode_seconds, format=encoding.extension(data))
+    bot_metrics.add("bytes_out", len(data), format=encoding.extension(data))
+    if key:
+        render_cache.put(key, data)
+    return data
+
+async def render_animation(anim, stages, format, options, key=None, slot=None):
+    """Apply effects to every frame of `anim`, split across the render
+    workers, and encode the result with save_animation's `format` and
+    `options`."""
+    if key:
+        data = await render_cache.get(key)
+        if data is not None:
+            return data
+
+    size = -(-len(anim.frames) // render_pool.size)
+    chunks = [anim.frames[i:i + size] for i in range(0, len(anim.frames), size)]
+    async with slot or contextlib.nullcontext():
+        with bot_metrics.timer("render", mode=apply_effects_frames.__name__):
+            results = await asyncio.gather(*(render_pool.run(apply_effects_frames, (chunk, stages)) for chunk in chunks))
+        frames = [frame for chunk in results for frame in chunk]
+        with bot_metrics.timer("encode", format=format.lower()):
+            data = await render_pool.run(save_animation, (frames, anim.durations, anim.loop, format), options)
+    bot_metrics.add("bytes_out", len(data), format=format.lower())
+    if key:
+        render_cache.put(key, data)
+    return data
+
+def parse_sweeps(kwargs, count):
+    """Pull `key=start:end` (or `start:end:log` for a geometric sweep) out of
+    kwargs and return the kwargs for each of `count` frames."""
+    sweeps = {}
+    for key, value in kwargs.items():
+        match = SWEEP.match(value) if isinstance(value, str) else None
+        if match is None:
+            continue
+        start, end = float(match[1]), float(match[2])
+        if match[3] and (start <= 0 or end <= 0):
+            raise ValueError(f"A log sweep of `{key}` needs positive endpoints.")
+        whole = all(part.lstrip("+-").isdigit() for part in match.group(1, 2))
+        sweeps[key] = (start, end, bool(match[3]), whole)
+    if not sweeps:
+        raise ValueError("Give at least one parameter to sweep, e.g. `max_iter=10:200`.")
+
+    frames = []
+    for i in range(count):
+        t = i / max(count - 1, 1)
+        frame = dict(kwargs)
+        for key, (start, end, log, whole) in sweeps.items():
+            value = start * (end / start) ** t if log else start + (end - start) * t
+            frame[key] = round(value) if whole else value
+        frames.append(frame)
+    return frames
+
+async def render_sweep(func, size, frame_kwargs, format, duration, key=None, slot=None, progress=None):
+    """Render one frame per kwargs dict, at most ANIMATE_WINDOW at a time,
+    then encode them all in one worker job."""
+    if key:
+        data = await render_cache.get(key)
+        if data is not None:
+            return data
+
+    todo = iter(frame_kwargs)
+    pending = collections.deque()
+    frames = []
+    async with slot or contextlib.nullcontext():
+        try:
+            with bot_metrics.timer("render", mode=func.__name__):
+                while True:
+                    while len(pending) < ANIMATE_WINDOW and (kwargs := next(todo, None)) is not None:
+                        pending.append(asyncio.ensure_future(render_pool.run(func, size, kwargs)))
+                    if not pending:
+                        break
+                    # The frame stays in pending until it is done, so a
+                    # cancellation always reaches it below.
+                    frames.append(await pending[0])
+                    pending.popleft()
+                    if progress:
+                        progress(len(frames) / len(frame_kwargs))
+        finally:
+            # Wait for the cancelled frames' workers to be killed before the
+            # slot is given to anyone else.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        with bot_metrics.timer("encode", format=format.lower()):
+            data = await render_pool.run(save_animation, (frames, duration, 0, format))
+    bot_metrics.add("bytes_out", len(data), format=format.lower())
+    if key:
+        render_cache.put(key, data)
+    return data
+
+def parse_effects(mode, args):
+    """Split `mode [key=value]... | mode [key=value]...` into stages."""
+    stages = []
+    for stage in " ".join((mode, *args)).split("|"):
+        words = stage.split()
+        if words:
+            stages.append((words[0], parse_kwargs(words[1:])))
+    return stages
+
+def effects_cost(img, stages):
+    # Each stage costs the pixels it outputs, so a resize up is charged for
+    # its result and the stages after it for the new size.
+    frames = img.frames if isinstance(img, attachments.Animation) else [img]
+    size = frames[0].size
+    cost = 0
+    for mode, kwargs in stages:
+        size = IMAGE_EFFECTS[mode].size(size, **kwargs)
+        cost += size[0] * size[1]
+    return cost * len(frames)
+
+async def send_help(ctx, text):
+    """Send help text as code blocks, split at line breaks to stay under
+    Discord's message length limit."""
+    chunks = [[]]
+    size = 0
+    for line in textwrap.dedent(text).strip("\n").splitlines():
+        if size + len(line) + 1 > HELP_CHUNK_CHARS and chunks[-1]:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(line)
+        size += len(line) + 1
+    for chunk in chunks:
+        await ctx.send("```\n" + "\n".join(chunk) + "\n```")
 
 async def get_image_from_context(ctx):
     target = ctx.message
@@ -53,68 +388,61 @@ async def get_image_from_context(ctx):
         target = await ctx.channel.fetch_message(ctx.message.reference.message_id)
 
     if not target.attachments:
-        return None
-
-    image_bytes = await target.attachments[0].read()
-    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-def log_init():
-    if not os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'w') as file:
-            file.write("")
-
-def sp_init():
-    if not os.path.exists(DB_FILE):
-        with open(DB_FILE, 'w') as file:
-            file.write("{}")
-
-async def logf(text):
-    with open(LOG_FILE, "a") as file:
-        file.write("{:%Y-%m-%d %H:%M:%S} ".format(datetime.datetime.now()) + text + "\n")
-
-log_init()
-sp_init()
+        return None, None
+
+    attachment = target.attachments[0]
+    # Only what is actually downloaded counts as bytes in, not cache hits.
+    cached = source_cache.get(attachment.id) is not None
+    with bot_metrics.timer("fetch"):
+        img, digest = await attachments.fetch_image(attachment, source_cache,
+                                                    IMAGE_MAX_BYTES, IMAGE_MAX_PIXELS, IMAGE_WORKING_SIZE,
+                                                    ANIMATION_MAX_FRAMES, ANIMATION_MAX_PIXELS)
+    if not cached:
+        bot_metrics.add("bytes_in", attachment.size)
+    return img, digest
+
+async def logf(ctx, action, target, delta=None):
+    await log_writer.write(splog.LogRecord(
+        datetime.datetime.now(), action, ctx.author.name, target, delta,
+        ctx.guild.name if ctx.guild else None,
+    ))
+
+sp_log = splog.LogFile(LOG_FILE)
+log_writer = splog.LogWriter(sp_log)
+storage.init(DB_FILE, LEGACY_DB_FILE)
+user_cache = storage.UserCache()
 
 # === Data Handling ===
 
-def load_data():
-    if not os.path.exists(DB_FILE):
-        return []
-    with open(DB_FILE, 'r') as file:
-        return json.load(file)
-
-def save_data(data):
-    with open(DB_FILE, 'w') as file:
-        json.dump(data, file, indent=2)
-
 def get_user(user_id):
-    data = load_data()
-    return next((user for user in data if user['id'] == str(user_id)), None)
+    return user_cache.get(user_id)
 
 def add_user(discord_user):
-    data = load_data()
-    user_id = str(discord_user.id)
-    if get_user(user_id):
+    if not user_cache.add(discord_user.id, discord_user.name):
         return False
-    data.append({
-        'id': user_id,
-        'name': discord_user.name,
-        'points': 0
-    })
-    save_data(data)
+    rank_index.set(discord_user.id, discord_user.name, 0)
     return True
 
-def update_user(user_id, field, value):
-    data = load_data()
-    for user in data:
-        if user['id'] == str(user_id):
-            user[field] = value
-            save_data(data)
-            return True
-    return False
+def get_ranks():
+    # Our own writes update the index as they happen; a new cache generation
+    # means it reloaded after someone else wrote to the database.
+    with bot_metrics.timer("db", op="refresh"):
+        user_cache.refresh()
+    if rank_index.version != user_cache.generation:
+        rank_index.load(user_cache.list(), user_cache.generation)
+    return rank_index
+
+@tasks.loop(seconds=USER_FLUSH_INTERVAL)
+async def flush_users():
+    with bot_metrics.timer("db", op="flush"):
+        user_cache.flush()
+
+@tasks.loop(seconds=METRICS_DUMP_INTERVAL)
+async def dump_metrics():
+    bot_metrics.dump(METRICS_FILE)
 
 def list_users():
-    data = load_data()
+    data = user_cache.list()
     if not data:
         return "No users yet."
     msg = "**📋 Users:**\n"
@@ -132,30 +460,44 @@ async def sp(ctx):
 async def add(ctx, user: discord.Member = None):
     user = user or ctx.author
     if add_user(user):
-        await logf(f"{user.name} added to system")
+        await logf(ctx, "add", user.name)
         await ctx.send(f" Added `{user.name}` to the sigma point system.")
     else:
         await ctx.send(f"`{user.name}` is already registered.")
 
-@sp.command(help="Give or take points from a user (negative for taking)")
-async def give(ctx, user: discord.Member, value: int):
+@sp.command(help="Give or take points from one or more users (negative for taking)")
+async def give(ctx, users: commands.Greedy[discord.Member], value: int):
     if "Pointmaster" not in [role.name for role in ctx.author.roles]:
         await ctx.send("🚫 You don’t have permission to give points.")
         return
-    if user.id == ctx.author.id:
-        await ctx.send("👀 You can’t give points to yourself.")
+    users = {user.id: user for user in users}
+    if not users:
+        await ctx.send("Mention at least one user to give points to.")
         return
-    target = get_user(user.id)
-    if not target:
-        await ctx.send("User not found. Add them first with `s9k sp add @user`.")
+    if ctx.author.id in users:
+        await ctx.send("👀 You can’t give points to yourself.")
         return
     if abs(value) > 25:
         await ctx.send("⚠️ You can’'t give/take more than 25 points at once.")
-    else:
-        target['points'] += value
-        update_user(user.id, 'points', target['points'])
-        await logf(f"{ctx.author.name} gave {user.name} {str(value)} points")
-        await ctx.send(f"`{user.name}` now has `{target['points']}` points.")
+        return
+
+    # add_points checks and applies the whole batch without awaiting, so no
+    # other command can run in between and it needs no lock.
+    try:
+        with bot_metrics.timer("db", op="add_points"):
+            totals = user_cache.add_points(users, value)
+    except KeyError as e:
+        await ctx.send(f"`{users[int(e.args[0])].name}` not found. Add them first with `s9k sp add @user`.")
+        return
+    with bot_metrics.timer("db", op="flush"):
+        user_cache.flush()
+
+    msg = ""
+    for user in users.values():
+        rank_index.set(user.id, user.name, totals[str(user.id)])
+        await logf(ctx, "give", user.name, value)
+        msg += f"`{user.name}` now has `{totals[str(user.id)]}` points.\n"
+    await ctx.send(msg)
 
 @sp.command(help="Get a specific user's points")
 async def get(ctx, user: discord.Member):
@@ -169,43 +511,102 @@ async def get(ctx, user: discord.Member):
 async def list(ctx):
     await ctx.send(list_users())
 
-@sp.command(aliases=["lb", "top", "leader"], help="Shows an ascending list of users and their points")
-async def leaderboard(ctx, count: int = 5):
-    data = load_data()
-    if not data:
+@sp.command(aliases=["lb", "top", "leader"], help="Shows an ascending list of users and their points, optionally by page (page=N)")
+async def leaderboard(ctx, count: typing.Optional[int] = 5, *args):
+    ranks = get_ranks()
+    if not len(ranks):
         await ctx.send("⚠️ No users in the system yet.")
         return
 
-    sorted_users = sorted(data, key=lambda x: x['points'], reverse=True)
-    count = min(count, len(sorted_users))
-    msg = f"**🏆 Leaderboard — Top {count} Users**\n"
+    try:
+        page = pop_options(parse_kwargs(args), LEADERBOARD_PARAMS)["page"]
+    except parameters.ParamError as e:
+        await ctx.send(f"🚫 {e}")
+        return
+    offset = (page - 1) * max(count, 0)
+    sorted_users = ranks.top(count, offset)
+    count = len(sorted_users)
+    if page == 1:
+        msg = f"**🏆 Leaderboard — Top {count} Users**\n"
+    else:
+        msg = f"**🏆 Leaderboard — Page {page}**\n"
 
     medals = ["🥇", "🥈", "🥉"] + ["🔹"] * (count - 3)
-    for i in range(count):
-        u = sorted_users[i]
+    for i, u in enumerate(sorted_users, start=offset):
         medal = medals[i] if i < len(medals) else f"`{i+1}.`"
         msg += f"{medal} `{u['name']}` — `{u['points']} pts`\n"
 
     await ctx.send(msg)
 
-@sp.command(help="Gets the SP log")
-async def log(ctx, entry=None):
+@sp.command(help="Shows a user's leaderboard position and percentile")
+async def rank(ctx, user: discord.Member = None):
+    user = user or ctx.author
+    ranks = get_ranks()
+    position = ranks.rank(user.id)
+    if position is None:
+        await ctx.send(" User not found.")
+        return
+    percentile = 100 * position / len(ranks)
+    await ctx.send(f"`{user.name}` is ranked `#{position}` of `{len(ranks)}` (top `{percentile:.1f}%`).")
+
+@sp.command(help="Gets the SP log, a single entry (<n> or latest), a range (from=<n> to=<n>) or a user's entries (user=, actor= or target=<name>)")
+async def log(ctx, entry=None, *args):
+    await log_writer.flush()
     if entry is None:
         if os.path.exists(LOG_FILE):
             await ctx.send(file=discord.File(LOG_FILE))
-    else:
-        with open(LOG_FILE, "r") as file:
-            lines = file.readlines()
-        try:
-            if entry == "latest":
-                await ctx.send(lines[len(lines) - 1])
-            else:
-                await ctx.send(lines[int(entry) - 1])
-        except IndexError:
+        return
+
+    if "=" not in entry:
+        line = sp_log.latest() if entry == "latest" else sp_log.line(int(entry))
+        if line is None:
             await ctx.send(f"Log entry {entry} does not exist.")
+        else:
+            await ctx.send(line)
+        return
+
+    filters = dict(arg.split("=", 1) for arg in (entry, *args) if "=" in arg)
+    start = int(filters.get("from", 1))
+    stop = int(filters["to"]) if "to" in filters else None
+    fields = {k: filters[k] for k in ("user", "actor", "target") if k in filters}
+    if fields:
+        entries = sp_log.search(start, stop, **fields)
+    else:
+        entries = sp_log.lines(start, stop)
+
+    msg = ""
+    for number, line in entries:
+        line = f"`{number}` {line}\n"
+        if len(msg) + len(line) > LOG_QUERY_CHARS:
+            msg += "… (more entries, narrow the query)"
+            break
+        msg += line
+    await ctx.send(msg or "No matching log entries.")
 
 # === Events ===
 
+@bot.event
+async def setup_hook():
+    flush_users.start()
+    log_writer.start()
+    bot_metrics.watch_loop(LOOP_LAG_INTERVAL)
+    if METRICS_PORT:
+        await bot_metrics.serve(METRICS_PORT)
+    if METRICS_FILE:
+        dump_metrics.start()
+
+@bot.before_invoke
+async def start_timer(ctx):
+    # Groups run this again for their subcommand; time from the first.
+    if not hasattr(ctx, "started"):
+        ctx.started = time.perf_counter()
+
+@bot.after_invoke
+async def record_timer(ctx):
+    # Only time the innermost command, not the group around it.
+    if ctx.invoked_subcommand is None:
+        bot_metrics.observe("command", time.perf_counter() - ctx.started, command=ctx.command.qualified_name)
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
@@ -227,327 +628,114 @@ async def image(ctx):
     if ctx.invoked_subcommand is None:
         await ctx.send("See usage: `s9k help image`")
 
-# === Image Effects ===
-
-@register_effect("mono")
-def effect_grayscale(img, **kwargs):
-        return img.convert("L").convert("RGB")
-
-@register_effect("invert")
-def effect_invert(img, **kwargs):
-    return ImageOps.invert(img)
-
-@register_effect("blur")
-def effect_blur(img, radius=3, **kwargs):
-    return img.filter(ImageFilter.GaussianBlur(radius))
-
-@register_effect("brightness")
-def effect_brightness(img, factor=1.0, **kwargs):
-    enhancer = ImageEnhance.Brightness(img)
-    return enhancer.enhance(factor)
-
-@register_effect("contrast")
-def effect_contrast(img, factor=1.0, **kwargs):
-    enhancer = ImageEnhance.Contrast(img)
-    return enhancer.enhance(factor)
-
-@register_effect("pixelate")
-def effect_pixelate(img, scale=8, **kwargs):
-    w, h = img.size
-    img = img.resize ((w//scale, h//scale), resample=Image.NEAREST)
-    return img.resize((w, h), resample=Image.NEAREST)
-
-@register_effect("posterize")
-def effect_posterize(img, bits=4, **kwargs):
-    return ImageOps.posterize(img, bits)
-
-@register_effect("solarize")
-def effect_solarize(img, threshold=128, **kwargs):
-    return ImageOps.solarize(img, threshold)
-
-@register_effect("jpegify")
-def effect_jpegify(img, quality=10, **kwargs):
-    jpg_buf = io.BytesIO()
-    img.convert("RGB").save(jpg_buf, format="JPEG", quality=quality)
-    jpg_buf.seek(0)
-    jpg_img = Image.open(jpg_buf)
-
-    png_buf = io.BytesIO()
-    jpg_img.save(png_buf, format="PNG")
-    png_buf.seek(0)
-    return Image.open(png_buf)
-
-@register_effect("resize")
-def effect_resize(img, width=None, height=None, **kwargs):
-    original_width, original_height = img.size
-
-    if width and not height:
-        ratio = width / original_width
-        height = int(original_height * ratio)
-    elif height and not width:
-        ratio = height / original_height
-        width = int(original_width * ratio)
-    elif not width and not height:
-        return img
-
-    width = int(width)
-    height = int(height)
-
-    return img.resize((width, height), resample=Image.NEAREST)
-
 @image.command(help="Apply effects to images")
 async def effect(ctx, mode: str=None, *args):
     if mode is None:
-        await ctx.send(
-        """
-        ```
+        await send_help(ctx, textwrap.dedent("""
         Image Effect Syntax
         Synopsis:
-        s9k image effect <mode> [key=value]...
+        s9k image effect <mode> [key=value]... [| <mode> [key=value]...]...
 
+        Chain several effects with | to apply them one after another in a single pass.
+        [format] [quality] [compress] pick the output encoding, as in image generate,
+        on any stage whose effect doesn't take a parameter of the same name (jpegify's quality is its own).
+        Animated GIFs and WebPs keep their animation, with the effect applied to every frame;
+        format=webp or png (APNG) re-encodes them, otherwise they keep their own format.
         Parameters are shown as [param=default_value]
+        Values outside a parameter's range are clamped to it.
 
-        Modes:
-        "mono": Converts the image to grayscale
-        Params: None
-        "invert": Inverts the color values of the image
-        Params: None
-        "blur": Blurs the image by [radius]
-        Params: [radius=3]
-        "brightness": Increases the brightness of the image by [factor]
-        Params: [factor=1.0]
-        "contrast": Increases the contrast of the image by [factor]
-        Params: [factor=1.0]
-        "pixelate": Enlarges the pixels of the image by [scale]
-        Params: [scale=8]
-        "posterize": Reduces the number of bits per color channel by [bits]
-        Params: [bits=4]
-        "solarize": Inverts all pixels brighter than [threshold]
-        Params: [threshold=128]
-        "jpegify": Converts an image to JPEG with [quality] (Still returns the image as PNG though)
-        Low quality will have more JPEG compression artifacts
-        Params: [quality=10]
-        "resize": Resizes the image to [width]x[height]
-        Params: [width] [height]
+        {modes}
 
         Example Commands:
         s9k image effect blur radius=20
         s9k image effect posterize bits=3
         s9k image effect resize width=256 height=256
-        ```
-        """)
+        s9k image effect blur radius=3 | posterize bits=3 | jpegify quality=5
+        """).format(modes=help_text(IMAGE_EFFECTS)))
         return
 
-    if mode not in IMAGE_EFFECTS:
-        available = ", ".join(IMAGE_GENERATORS.keys())
-        await ctx.send(f"Unknown mode `{mode}`. Available modes: `{available}`")
-        return
+    stages = parse_effects(mode, args)
+    for stage, _ in stages:
+        if stage not in IMAGE_EFFECTS:
+            available = ", ".join(IMAGE_EFFECTS.keys())
+            await ctx.send(f"Unknown mode `{stage}`. Available modes: `{available}`")
+            return
 
-    image_bytes = await get_image_from_context(ctx)
+    try:
+        image_bytes, digest = await get_image_from_context(ctx)
+    except attachments.ImageRejected as e:
+        await ctx.send(f"🚫 {e}")
+        return
     if not image_bytes:
         await ctx.send("Please attach an image or reply to a message with an image.")
         return
 
-    kwargs = parse_kwargs(args)
-
+    name = "-".join(stage for stage, _ in stages)
     msg = await ctx.send("Applying effect...")
-    img = IMAGE_EFFECTS[mode](image_bytes, **kwargs)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-
-    await ctx.send(file=discord.File(buf, f"{mode}.png"))
+    try:
+        # Output options may be given on any stage, except where the stage's
+        # effect has a parameter of the same name, like jpegify's quality.
+        output = {}
+        for stage, kwargs in stages:
+            own = IMAGE_EFFECTS[stage].params.params
+            output.update((k, kwargs.pop(k)) for k in OUTPUT_PARAMS.params if k in kwargs and k not in own)
+        format_given = "format" in output
+        output = output_options(ctx, output)
+        notes = []
+        for i, (stage, kwargs) in enumerate(stages):
+            kwargs, clamped = IMAGE_EFFECTS[stage].params.normalize(kwargs)
+            stages[i] = (stage, kwargs)
+            notes += clamped
+            bot_metrics.add("effects", effect=stage)
+        slot = render_slot(ctx, msg, effects_cost(image_bytes, stages))
+        if isinstance(image_bytes, attachments.Animation):
+            format, options, note = animation_output(image_bytes, output, format_given)
+            if note:
+                notes.append(note)
+            key = effects_key(image_bytes, digest, stages, {"format": format, **options})
+            data = await cancellable(ctx, msg, render_animation(image_bytes, stages, format, options, key=key, slot=slot))
+            with bot_metrics.timer("upload"):
+                await ctx.send("\n".join(notes) or None,
+                               file=discord.File(io.BytesIO(data), f"{name}.{format.lower()}"))
+        else:
+            key = effects_key(image_bytes, digest, stages, output)
+            async with progress_updates(msg) as report:
+                data = await cancellable(ctx, msg, render(apply_effects, (image_bytes, stages), key=key,
+                                                          output=output, slot=slot, progress=report))
+            with bot_metrics.timer("upload"):
+                await ctx.send("\n".join(notes) or None,
+                               file=discord.File(io.BytesIO(data), f"{name}.{encoding.extension(data)}"))
+    except RenderCancelled:
+        await ctx.send("Effect cancelled.")
+    except parameters.ParamError as e:
+        await ctx.send(f"🚫 {e}")
+    except asyncio.TimeoutError:
+        await ctx.send(f"Effect took longer than {RENDER_TIMEOUT}s and was cancelled.")
+    except Exception as e:
+        await ctx.send(f"Error: `{e}`")
     await msg.delete()
 
-# === Image Generation Modes ===
-
-@register_generator("white_noise")
-def generate_white_noise(width, height):
-    img = Image.new("L", (width, height))
-    pixels = [
-        random.randint(0, 255)
-        for _ in range(width * height)
-    ]
-    img.putdata(pixels)
-    return img.convert("RGB")
-
-@register_generator("color_noise")
-def generate_color_noise(width, height):
-    img = Image.new("RGB", (width, height))
-    pixels = [
-        (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-        for _ in range(width * height)
-    ]
-    img.putdata(pixels)
-    return img
-
-@register_generator("plasma")
-def generate_plasma(width, height):
-    img = Image.new("RGB", (width, height))
-    pixels = []
-
-    for y in range(height):
-        for x in range(width):
-            r = int(127 * (math.sin(x * random.uniform(0.079, 0.081)) + 1))
-            g = int(127 * (math.sin(y * random.uniform(0.079, 0.081)) + 1))
-            b = int(127 * (math.sin((x + y) * random.uniform(0.079, 0.081)) + 1))
-            pixels.append((r, g, b))
-
-    img.putdata(pixels)
-    return img
-
-from PIL import Image
-
-@register_generator("mandelbrot")
-def generate_mandelbrot(width=256, height=256, max_iter=100, **kwargs):
-    img = Image.new("RGB", (width, height))
-    pixels = img.load()
-
-    x_min, x_max = -2.5, 1
-    y_min, y_max = -1.25, 1.25
-
-    for x in range(width):
-        for y in range(height):
-            zx = x / width * (x_max - x_min) + x_min
-            zy = y / height * (y_max - y_min) + y_min
-            z = complex(0, 0)
-            c = complex(zx, zy)
-
-            i = 0
-            while abs(z) <= 2 and i < max_iter:
-                z = z*z + c
-                i += 1
-
-            color = 255 - int(i * 255 / max_iter)
-            pixels[x, y] = (color, color, color)
-
-    return img
-
-@register_generator("burning_ship")
-def generate_burning_ship(width=256, height=256, max_iter=100, **kwargs):
-    img = Image.new("RGB", (width, height))
-    pixels = img.load()
-
-    x_min, x_max = -2.5, 1
-    y_min, y_max = -1.25, 1.25
-
-    for x in range(width):
-        for y in range(height):
-            zx = x / width * (x_max - x_min) + x_min
-            zy = y / height * (y_max - y_min) + y_min
-            z = complex(0, 0)
-            c = complex(zx, zy)
-
-            i = 0
-            while abs(z) <= 2 and i < max_iter:
-                z = complex(abs(z.real), abs(z.imag))
-                z = z*z + c
-                i += 1
-
-            color = 255 - int(i * 255 / max_iter)
-            pixels[x, y] = (color, color, color)
-
-    return img
-
-@register_generator("sierpinski_triangle")
-def generate_sierpinski(width=256, height=256, iterations=10000, **kwargs):
-    img = Image.new("RGB", (width, height), "black")
-    draw = ImageDraw.Draw(img)
-
-    p1 = (width // 2, 0)
-    p2 = (0, height - 1)
-    p3 = (width - 1, height - 1)
-    vertices = [p1, p2, p3]
-
-    x, y = random.randint(0, width), random.randint(0, height)
-
-    for _ in range(iterations):
-        target = random.choice(vertices)
-        x = (x + target[0]) // 2
-        y = (y + target[1]) // 2
-        draw.point((x, y), fill="white")
-
-    return img
-
-from PIL import Image, ImageDraw
-import math
-
-@register_generator("koch_snowflake")
-def generate_koch_snowflake(width=512, height=512, iterations=4, **kwargs):
-    img = Image.new("RGB", (width, height), "black")
-    draw = ImageDraw.Draw(img)
-
-    size = min(width, height) * 0.8
-    height_triangle = size * math.sqrt(3) / 2
-
-    p1 = ((width - size) / 2, height / 2 + height_triangle / 3)
-    p2 = ((width + size) / 2, height / 2 + height_triangle / 3)
-    p3 = (width / 2, height / 2 - 2 * height_triangle / 3)
-
-    def koch_curve(draw, p1, p2, iter):
-        if iter == 0:
-            draw.line([p1, p2], fill="white")
-            return
-
-        dx = (p2[0] - p1[0]) / 3
-        dy = (p2[1] - p1[1]) / 3
-
-        a = p1
-        b = (p1[0] + dx, p1[1] + dy)
-        d = (p1[0] + 2 * dx, p1[1] + 2 * dy)
-        e = p2
-
-        angle = math.radians(60)
-        cx = b[0] + math.cos(angle) * (d[0] - b[0]) - math.sin(angle) * (d[1] - b[1])
-        cy = b[1] + math.sin(angle) * (d[0] - b[0]) + math.cos(angle) * (d[1] - b[1])
-        c = (cx, cy)
-
-        koch_curve(draw, a, b, iter - 1)
-        koch_curve(draw, b, c, iter - 1)
-        koch_curve(draw, c, d, iter - 1)
-        koch_curve(draw, d, e, iter - 1)
-
-    koch_curve(draw, p1, p2, iterations)
-    koch_curve(draw, p2, p3, iterations)
-    koch_curve(draw, p3, p1, iterations)
-
-    return img
-
 @image.command(help="Generate synthetic images")
 async def generate(ctx, mode: str=None, width: int=256, height: int=256, *args):
     if mode is None:
-        await ctx.send(
-        """
-        ```
+        await send_help(ctx, textwrap.dedent("""
         Image Generate Syntax
         Synopsis:
         s9k image generate <mode> [width] [height] [key=value]...
 
         If width/height is not provided, it will default to 256.
+        Random modes take [seed] to make the output repeatable.
+        Parameters are shown as [param=default_value]
+        Values outside a parameter's range are clamped to it, e.g. max_iter to at most 10000.
+        Output: [format=png] png, webp, jpeg, or auto for the smallest that fits
+        [quality=90] for webp/jpeg (webp 100 is lossless), [compress=6] for png 0-9
+
+        {modes}
 
-        Modes:
-        "white_noise": Grayscale static, like TV static
-        Params: None
-        "color_noise": Random color noise
-        Params: None
-        "plasma": Wavy colorful noise using sine waves
-        Params: None
-        "sierpinski_triangle": An equilateral triangle subdivided recursively into smaller equilateral triangles.
-        Params: [iterations=10000]
-        "koch_snowflake": A spiky, infinitely detailed, starry snowflake shape made of smaller and smaller triangle bumps.
-        Params: [iterations=4]
-
-
-        Slow Modes: (These are slower as they require complex math)
-        "manelbrot": A complex, endlessly detailed shape with bulbous, rounded blobs connected by thin filaments,
-        Params: [max_iter=100]
-        "burning_ship": A fiery, jagged, and ship-like structure, with flame-like tendrils, sharp edges, and mirrored symmetry.
-        The Burning Ship fractal is very mathematically similar to the Mandelbrot set, yet looks completely different.
-        [max_iter=10]
-        Example Command:
+        Example Commands:
         s9k image generate mandelbrot 128 128 max_iter=100
-        ```
-        """)
+        s9k image generate ifs 512 512 maps=[(0.5,-0.5,0.5,0.5,0,0),(-0.5,-0.5,0.5,-0.5,1,0)]
+        """).format(modes=help_text(IMAGE_GENERATORS)))
         return
     if mode not in IMAGE_GENERATORS:
         available = ", ".join(IMAGE_GENERATORS.keys())
@@ -559,19 +747,133 @@ async def generate(ctx, mode: str=None, width: int=256, height: int=256, *args):
 
     try:
         kwargs = parse_kwargs(args)
+        output = output_options(ctx, kwargs)
+        func = IMAGE_GENERATORS[mode]
+        kwargs, notes = func.params.normalize(kwargs)
 
         msg = await ctx.send("Generating...")
-        img = IMAGE_GENERATORS[mode](width, height, **kwargs)
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        await ctx.send(file=discord.File(buf, f"{mode}.png"))
+        key = render_key(func, (width, height), {**kwargs, **output})
+        slot = render_slot(ctx, msg, func.cost(width, height, **kwargs))
+        async with progress_updates(msg) as report:
+            data = await cancellable(ctx, msg, render(func, (width, height), kwargs, key=key, output=output, slot=slot,
+                                                      progress=report if func.reports_progress else None))
+        with bot_metrics.timer("upload"):
+            await ctx.send("\n".join(notes) or None, file=discord.File(io.BytesIO(data), f"{mode}.{encoding.extension(data)}"))
         await msg.delete()
+    except RenderCancelled:
+        await msg.delete()
+        await ctx.send("Render cancelled.")
+    except parameters.ParamError as e:
+        await ctx.send(f"🚫 {e}")
+    except asyncio.TimeoutError:
+        await ctx.send(f"Render took longer than {RENDER_TIMEOUT}s and was cancelled.")
     except Exception as e:
         await ctx.send(f"Error: `{e}`")
 
+@image.command(help="Animate a generator by sweeping its parameters")
+async def animate(ctx, mode: str=None, width: int=256, height: int=256, *args):
+    if mode is None:
+        await send_help(ctx, f"""
+        Image Animate Syntax
+        Synopsis:
+        s9k image animate <mode> [width] [height] [frames=N] [key=start:end]... [key=value]...
+
+        Renders [frames] frames of a generator mode, moving each key=start:end
+        parameter evenly from start to end. Use start:end:log to sweep
+        geometrically, e.g. for zoom. Other parameters work as in generate.
+
+        Options:
+        [frames=24] Number of frames, at most {ANIMATE_MAX_FRAMES}
+        [duration=100] Milliseconds per frame
+        [format=gif] gif, webp or apng
+
+        Frames x width x height is limited to {ANIMATE_MAX_PIXELS:,} pixels.
+
+        Example Commands:
+        s9k image animate mandelbrot 256 256 max_iter=5:100
+        s9k image animate koch_snowflake 512 512 frames=6 iterations=0:5 duration=500
+        s9k image animate mandelbrot 256 256 frames=60 zoom=1:100000:log center_x=-0.7436 center_y=0.1318 format=webp
+        """)
+        return
+
+    if mode not in IMAGE_GENERATORS:
+        available = ", ".join(IMAGE_GENERATORS.keys())
+        await ctx.send(f"Unknown mode `{mode}`. Available modes: `{available}`")
+        return
+    if width > 1024 or height > 1024:
+        await ctx.send("Max size is 1024 to prevent overload.")
+        return
+
+    try:
+        kwargs = parse_kwargs(args)
+        options = pop_options(kwargs, ANIMATE_PARAMS)
+        count, duration = options["frames"], options["duration"]
+        if count * width * height > ANIMATE_MAX_PIXELS:
+            await ctx.send(f"{count} frames at {width}x{height} is over the {ANIMATE_MAX_PIXELS:,} pixel limit.")
+            return
+        func = IMAGE_GENERATORS[mode]
+        notes = []
+        frame_kwargs = []
+        for frame in parse_sweeps(kwargs, count):
+            frame, clamped = func.params.normalize(frame)
+            frame_kwargs.append(frame)
+            notes += (note for note in clamped if note not in notes)
+
+        msg = await ctx.send("Animating...")
+        format, extension = ANIMATION_FORMATS[options["format"]]
+        key = render_key(func, (width, height, "animate", duration, format, frame_kwargs), frame_kwargs[0])
+        slot = render_slot(ctx, msg, sum(func.cost(width, height, **frame) for frame in frame_kwargs))
+        async with progress_updates(msg) as report:
+            data = await cancellable(ctx, msg, render_sweep(func, (width, height), frame_kwargs, format, duration,
+                                                            key=key, slot=slot, progress=report))
+        with bot_metrics.timer("upload"):
+            await ctx.send("\n".join(notes) or None, file=discord.File(io.BytesIO(data), f"{mode}.{extension}"))
+        await msg.delete()
+    except RenderCancelled:
+        await msg.delete()
+        await ctx.send("Animation cancelled.")
+    except parameters.ParamError as e:
+        await ctx.send(f"🚫 {e}")
+    except asyncio.TimeoutError:
+        await ctx.send(f"A frame took longer than {RENDER_TIMEOUT}s and the animation was cancelled.")
+    except Exception as e:
+        await ctx.send(f"Error: `{e}`")
+
+@image.command(help="Cancel your running and queued renders")
+async def cancel(ctx):
+    tasks = running_renders.get(ctx.author.id)
+    if not tasks:
+        await ctx.send("You have no renders running.")
+        return
+    for task in tasks:
+        task.cancel()
+    await ctx.send(f"Cancelling {len(tasks)} render{'s' if len(tasks) > 1 else ''}.")
+
+@image.command(help="Reload the generator and effect plugins without restarting (owner only)")
+@commands.is_owner()
+async def reload(ctx):
+    try:
+        modules = reload_plugins()
+    except Exception as e:
+        await ctx.send(f"Reload failed, keeping the old plugins: `{e!r}`")
+        return
+    # Workers still run the old code, and are forked from a process that
+    # needs the new plugins too. Cached renders need nothing: the code
+    # version in their keys has changed.
+    render_pool.restart(reload_plugins)
+    await ctx.send(f"Reloaded `{', '.join(modules)}`: {len(IMAGE_GENERATORS)} generators, {len(IMAGE_EFFECTS)} effects.")
+
 # === Base Commands ===
 
+@bot.command(help="Show latency percentiles (ms), counts and bytes, optionally for some names only (owner only)")
+@commands.is_owner()
+async def stats(ctx, *names):
+    text = bot_metrics.summary(names)
+    if not names:
+        text += f"\nrender cache: {render_cache.hits:,} hits, {render_cache.misses:,} misses"
+        text += f"\nrender queue: {render_scheduler.waiting()} waiting"
+    await send_help(ctx, text)
+
 @bot.command(help="Says hello")
 async def hello(ctx):
     if commands.is_owner():
@@ -579,33 +881,39 @@ async def hello(ctx):
     else:
         await ctx.send("Hello.")
 
-@bot.command(help="Evaluates a math expression. Safe functions only (sin, cos, abs, etc.)")
+@bot.command(help="Evaluates a math expression. Safe functions only (sin, cos, abs, etc.). "
+                  "Add `for x in 0..10 step 0.1` for stats over a range, or `... plot` to graph it")
 async def calc(ctx, *, expression):
-    allowed_names = {
-        k: getattr(math, k) for k in dir(math) if not k.startswith("__")
-    }
-    allowed_names.update({
-        "abs": abs,
-        "round": round
-    })
-
-    def safe_eval(expr: str) -> float:
-        safe_globals = {"__builtins__": {}}
-
-        return eval(expr, safe_globals, allowed_names)
+    if expression == "open(\"TOKEN\")" or expression == "open('TOKEN')":
+        await ctx.send("No.")
+        return
 
     try:
-        if expression == "open(\"TOKEN\")" or expression == "open('TOKEN')":
-            await ctx.send("No.")
+        values = calculator.parse_range(expression)
+        if values:
+            result = await calc_pool.run(calculator.evaluate_range, values)
+            if isinstance(result, bytes):
+                await ctx.send(file=discord.File(io.BytesIO(result), "plot.png"))
+            else:
+                await ctx.send(f"Result: `{result}`")
         else:
-            result = safe_eval(expression)
-            await ctx.send(f"Result: `{result}`")
-    except NameError as e:
-        await ctx.send(f"Error: `{e}`. Not allowed or not found.")
+            result = await calc_pool.run(calculator.evaluate, (calculator.compile_expression(expression),))
+            await ctx.send(f"Result: `{calculator.format_result(result)}`")
+    except calculator.CalcError as e:
+        await ctx.send(f"🚫 {e}")
+    except asyncio.TimeoutError:
+        await ctx.send(f"That took longer than {CALC_TIMEOUT}s and was stopped.")
     except Exception as e:
         await ctx.send(f"Error: `{e}`")
 
 # === Run the bot ===
 TOKEN = open("TOKEN", "r").read().strip()
-bot.run(TOKEN)
+try:
+    bot.run(TOKEN)
+finally:
+    render_pool.shutdown()
+    calc_pool.shutdown()
+    log_writer.drain()
+    user_cache.flush()
+    storage.close()
 
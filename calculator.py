@@ -0,0 +1,230 @@
+import ast
+import functools
+import io
+import math
+import operator
+import re
+
+from PIL import Image, ImageDraw
+
+from lazy import LazyModule
+
+# numpy is only needed for ranges, which run in a worker.
+np = LazyModule("numpy")
+
+# Limits on what one expression may ask for. Integers are exact in Python,
+# so their size is what makes arithmetic slow; everything else is bounded
+# by the size of the expression itself.
+MAX_LENGTH = 500
+MAX_NODES = 1000
+MAX_OPERATIONS = 300
+MAX_BITS = 10_000
+MAX_EXPONENT = 10_000
+FACTORIAL_LIMIT = 1000
+MAX_POINTS = 1_000_000
+CACHE_SIZE = 256
+
+RANGE = re.compile(
+    r"^(?P<expr>.+?)\s+for\s+(?P<var>[A-Za-z_]\w*)\s+in\s+(?P<start>[^\s.]+(?:\.\d+)?)\.\.(?P<stop>\S+?)"
+    r"(?:\s+step\s+(?P<step>\S+))?(?:\s+(?P<output>stats|plot))?$"
+)
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+NAMES = {k: getattr(math, k) for k in dir(math) if not k.startswith("_")}
+NAMES.update({"abs": abs, "round": round})
+
+# Vectorized equivalents for ranges; names missing here only work on numbers.
+@functools.cache
+def array_names():
+    names = {
+        name: getattr(np, name) for name in (
+            "sin", "cos", "tan", "sinh", "cosh", "tanh", "arcsin", "arccos", "arctan", "exp", "expm1",
+            "log2", "log10", "log1p", "sqrt", "floor", "ceil", "trunc", "degrees", "radians", "hypot",
+            "copysign", "pi", "e", "tau", "inf", "nan",
+        ) if hasattr(np, name)
+    }
+    names.update({
+        "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan, "atan2": np.arctan2,
+        "asinh": np.arcsinh, "acosh": np.arccosh, "atanh": np.arctanh,
+        "fabs": np.abs, "abs": np.abs, "round": np.round, "pow": np.power,
+        "log": lambda x, base=None: np.log(x) if base is None else np.log(x) / np.log(base),
+    })
+    return names
+
+# Integer functions whose cost grows with their argument.
+GROWING = {"factorial", "comb", "perm"}
+
+
+class CalcError(Exception):
+    """Raised with a user-facing reason when an expression is refused."""
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(text, variables=()):
+    """Parse and validate an expression once; the tree is shared, so
+    callers must not modify it."""
+    if len(text) > MAX_LENGTH:
+        raise CalcError(f"Expressions are limited to {MAX_LENGTH} characters.")
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except (SyntaxError, RecursionError, MemoryError, ValueError):
+        raise CalcError("That isn't a valid expression.")
+    nodes = list(ast.walk(tree.body))
+    if len(nodes) > MAX_NODES:
+        raise CalcError("That expression is too long.")
+    for node in nodes:
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float, complex)):
+                raise CalcError("Only numbers are allowed.")
+        elif isinstance(node, ast.Name):
+            if node.id not in NAMES and node.id not in variables:
+                raise CalcError(f"`{node.id}` is not allowed or not found.")
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.keywords:
+                raise CalcError("Only plain calls like `sqrt(2)` are allowed.")
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) not in OPERATORS:
+                raise CalcError("That operator isn't allowed.")
+        elif isinstance(node, ast.UnaryOp):
+            if type(node.op) not in UNARY:
+                raise CalcError("That operator isn't allowed.")
+        elif not isinstance(node, (ast.Load, ast.operator, ast.unaryop)):
+            raise CalcError(f"`{type(node).__name__}` isn't allowed.")
+    return tree.body
+
+
+def _check_int(value):
+    if isinstance(value, int) and value.bit_length() > MAX_BITS:
+        raise CalcError(f"Integers are limited to {MAX_BITS:,} bits.")
+    return value
+
+
+def _power(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 and exponent > 0:
+        # The result has at least this many bits, and at most about twice as many.
+        if exponent > MAX_EXPONENT or (abs(base).bit_length() - 1) * exponent + 1 > MAX_BITS:
+            raise CalcError(f"Integers are limited to {MAX_BITS:,} bits.")
+    return operator.pow(base, exponent)
+
+
+def _call(name, func, args):
+    if name in GROWING and any(isinstance(arg, int) and arg > FACTORIAL_LIMIT for arg in args):
+        raise CalcError(f"`{name}` is limited to arguments up to {FACTORIAL_LIMIT}.")
+    return func(*args)
+
+
+def evaluate(node, names=NAMES, variables=None):
+    """Evaluate a compiled expression, counting operations as it goes."""
+    operations = 0
+    variables = variables or {}
+
+    def visit(node):
+        nonlocal operations
+        operations += 1
+        if operations > MAX_OPERATIONS:
+            raise CalcError(f"Expressions are limited to {MAX_OPERATIONS} operations.")
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in variables:
+                return variables[node.id]
+            if node.id not in names:
+                raise CalcError(f"`{node.id}` isn't available for ranges.")
+            return names[node.id]
+        if isinstance(node, ast.UnaryOp):
+            return UNARY[type(node.op)](visit(node.operand))
+        if isinstance(node, ast.BinOp):
+            left, right = visit(node.left), visit(node.right)
+            if isinstance(node.op, ast.Pow):
+                return _check_int(_power(left, right))
+            return _check_int(OPERATORS[type(node.op)](left, right))
+        func = visit(node.func)
+        return _check_int(_call(node.func.id, func, [visit(arg) for arg in node.args]))
+
+    return visit(node)
+
+
+def parse_range(text):
+    """Split `expr for x in start..stop [step s] [stats|plot]`, or return
+    None for a plain expression."""
+    match = RANGE.match(text.strip())
+    if match is None:
+        return None
+    try:
+        start, stop = float(match["start"]), float(match["stop"])
+        step = float(match["step"]) if match["step"] else 1.0
+    except ValueError:
+        raise CalcError("Ranges look like `0..10 step 0.5`.")
+    if step <= 0 or stop < start:
+        raise CalcError("Ranges need start <= stop and a positive step.")
+    if (stop - start) / step + 1 > MAX_POINTS:
+        raise CalcError(f"Ranges are limited to {MAX_POINTS:,} points.")
+    node = compile_expression(match["expr"], (match["var"],))
+    return node, match["var"], (start, stop, step), match["output"] or "stats"
+
+
+def evaluate_range(node, variable, bounds, output):
+    """Evaluate over the range with NumPy. Returns summary text, or PNG
+    bytes for a plot."""
+    start, stop, step = bounds
+    xs = start + np.arange(int(math.floor((stop - start) / step + 1e-9)) + 1) * step
+    with np.errstate(all="ignore"):
+        ys = np.broadcast_to(np.asarray(evaluate(node, array_names(), {variable: xs}), dtype=float), xs.shape)
+    if output == "plot":
+        return plot(xs, ys)
+    finite = ys[np.isfinite(ys)]
+    if not len(finite):
+        return f"{len(ys)} points, none finite"
+    text = (f"{len(ys)} points, min {finite.min():.6g}, max {finite.max():.6g}, "
+            f"mean {finite.mean():.6g}, std {finite.std():.6g}, sum {finite.sum():.6g}")
+    if len(finite) < len(ys):
+        text += f" ({len(ys) - len(finite)} not finite)"
+    return text
+
+
+def plot(xs, ys, width=800, height=400, margin=40):
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    finite = np.isfinite(ys)
+    if finite.any():
+        low, high = ys[finite].min(), ys[finite].max()
+        if high == low:
+            low, high = low - 1, high + 1
+        px = margin + (xs - xs[0]) / max(xs[-1] - xs[0], 1e-300) * (width - 2 * margin)
+        py = height - margin - (ys - low) / (high - low) * (height - 2 * margin)
+        if low < 0 < high:
+            zero = height - margin - (-low) / (high - low) * (height - 2 * margin)
+            draw.line([(margin, zero), (width - margin, zero)], fill="lightgray")
+        # Break the line wherever the values aren't finite.
+        breaks = np.flatnonzero(~finite)
+        for run_x, run_y in zip(np.split(px, breaks), np.split(py, breaks)):
+            run = np.column_stack([run_x, run_y])
+            run = run[np.isfinite(run[:, 1])]
+            if len(run) > 1:
+                draw.line(run.ravel().tolist(), fill="blue")
+            elif len(run) == 1:
+                draw.point(tuple(run[0]), fill="blue")
+        draw.text((4, margin - 12), f"{high:.4g}", fill="black")
+        draw.text((4, height - margin), f"{low:.4g}", fill="black")
+    draw.text((margin, height - margin + 14), f"{xs[0]:.4g}", fill="black")
+    draw.text((width - margin - 40, height - margin + 14), f"{xs[-1]:.4g}", fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def format_result(value, limit=1900):
+    text = str(value)
+    if len(text) > limit:
+        text = f"{text[:40]}…{text[-20:]} ({len(text)} digits)"
+    return text
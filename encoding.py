@@ -0,0 +1,65 @@
+import io
+
+FORMATS = ("png", "webp", "jpeg", "auto")
+DEFAULT_QUALITY = 90
+DEFAULT_COMPRESS = 6
+
+# Tried by auto mode once no lossless encoding fits, best quality first.
+LOSSY_FALLBACKS = (("webp", 90), ("jpeg", 90), ("webp", 75), ("webp", 50), ("jpeg", 50), ("webp", 25))
+
+
+class TooLarge(Exception):
+    """Raised when no encoding of an image fits in the size limit."""
+
+
+def encode(img, format="png", quality=None, compress=None, limit=None):
+    """Encode an image and return the bytes.
+
+    `quality` (1-100) applies to webp and jpeg, with webp at 100 being
+    lossless; `compress` (0-9) is the PNG compress_level. "auto" returns the
+    smallest lossless encoding that fits in `limit` bytes, and otherwise the
+    best lossy one that does.
+    """
+    if format == "auto":
+        return encode_auto(img, limit)
+
+    buf = io.BytesIO()
+    if format == "png":
+        img.save(buf, format="PNG", compress_level=DEFAULT_COMPRESS if compress is None else compress)
+    elif format == "webp":
+        if quality is None or quality < 100:
+            img.save(buf, format="WEBP", quality=DEFAULT_QUALITY if quality is None else quality)
+        else:
+            img.save(buf, format="WEBP", lossless=True)
+    elif format == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=DEFAULT_QUALITY if quality is None else quality)
+    else:
+        raise ValueError(f"Unknown format `{format}`. Available formats: `{', '.join(FORMATS)}`")
+    return buf.getvalue()
+
+
+def encode_auto(img, limit):
+    lossless = min((encode(img, "png"), encode(img, "webp", 100)), key=len)
+    if limit is None or len(lossless) <= limit:
+        return lossless
+    for format, quality in LOSSY_FALLBACKS:
+        data = encode(img, format, quality)
+        if len(data) <= limit:
+            return data
+    raise TooLarge(f"The image doesn't fit in {limit / 2**20:.1f} MB even as a low quality WebP.")
+
+
+def extension(data):
+    """File extension for encoded image bytes, judged by their signature."""
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data.startswith(b"GIF8"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
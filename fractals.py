@@ -0,0 +1,298 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, localcontext
+
+import numpy as np
+from PIL import Image
+
+import workers
+
+# Images are split into square tiles rendered on a thread pool; NumPy drops
+# the GIL inside its loops so the tiles run on separate cores.
+TILE_SIZE = 256
+
+# Below this pixel spacing (relative to the size of the coordinates) float64
+# can no longer tell neighbouring pixels apart, so perturbation takes over.
+PRECISION_LIMIT = 1e-12
+
+# Bailout radius used for smooth colouring; a large radius keeps the
+# fractional iteration count free of banding.
+SMOOTH_BAILOUT = 256.0
+
+# Orbits are compared against a snapshot taken at every power of two
+# iterations (Brent's cycle detection). Points that land back on their
+# snapshot are periodic, so they are inside the set and can stop early.
+CYCLE_CHECK = 8
+CYCLE_EPSILON = 1e-24
+
+# === Iteration steps ===
+# Each step maps (x, y) -> z^2 + c for its variant, working on the real and
+# imaginary parts as separate float arrays.
+
+def mandelbrot_step(x, y, cx, cy):
+    xy = x * y
+    x2 = x * x
+    x2 -= y * y
+    x2 += cx
+    xy *= 2
+    xy += cy
+    return x2, xy
+
+def burning_ship_step(x, y, cx, cy):
+    xy = abs(x * y)
+    x2 = x * x
+    x2 -= y * y
+    x2 += cx
+    xy *= 2
+    xy += cy
+    return x2, xy
+
+def tricorn_step(x, y, cx, cy):
+    xy = x * y
+    x2 = x * x
+    x2 -= y * y
+    x2 += cx
+    xy *= -2
+    xy += cy
+    return x2, xy
+
+def multibrot_step(power):
+    def step(x, y, cx, cy):
+        z = (x + 1j * y) ** power
+        return z.real + cx, z.imag + cy
+    return step
+
+def mandelbrot_interior(cx, cy):
+    # Main cardioid and period-2 bulb, which cover most of the interior.
+    q = (cx - 0.25) ** 2 + cy * cy
+    cardioid = q * (q + (cx - 0.25)) <= 0.25 * cy * cy
+    bulb = (cx + 1) ** 2 + cy * cy <= 0.0625
+    return cardioid | bulb
+
+# === Perturbation steps ===
+# Each maps the offset (dx, dy) of an orbit from the reference orbit value
+# (X, Y) to the next offset, given the offset (dcx, dcy) of its c.
+
+def mandelbrot_delta_step(X, Y, dx, dy, dcx, dcy):
+    nx = 2 * (X * dx - Y * dy) + dx * dx - dy * dy + dcx
+    ny = 2 * (X * dy + Y * dx + dx * dy) + dcy
+    return nx, ny
+
+def _diffabs(c, d):
+    # |c + d| - |c| without the cancellation of computing it directly.
+    cd = c + d
+    return np.where(c >= 0, np.where(cd >= 0, d, -(2 * c + d)),
+                    np.where(cd > 0, 2 * c + d, -d))
+
+def burning_ship_delta_step(X, Y, dx, dy, dcx, dcy):
+    nx = 2 * (X * dx - Y * dy) + dx * dx - dy * dy + dcx
+    ny = 2 * _diffabs(X * Y, X * dy + Y * dx + dx * dy) + dcy
+    return nx, ny
+
+# === Engine ===
+
+def _escape_count(i, mag2, smooth, bailout, power):
+    if not smooth:
+        return i
+    log_z = np.log(mag2) / 2
+    return i + 1 - np.log(log_z / np.log(bailout)) / np.log(power)
+
+def escape_time(xs, ys, step, max_iter=100, c=None, power=2, smooth=False, bailout=2.0, interior=None):
+    """Iteration counts for every point of the (xs, ys) grid.
+
+    With `c=None` each point is its own c and the orbit starts at 0
+    (Mandelbrot-style); otherwise the orbit starts at the point and `c` is
+    shared (Julia-style). Points that never escape get `max_iter`.
+    """
+    shape = xs.shape
+    counts = np.full(xs.size, float(max_iter))
+    idx = np.arange(xs.size)
+
+    if c is None:
+        cx, cy = xs.ravel().copy(), ys.ravel().copy()
+        x, y = np.zeros_like(cx), np.zeros_like(cy)
+    else:
+        c = complex(c)
+        x, y = xs.ravel().copy(), ys.ravel().copy()
+        cx, cy = np.full_like(x, c.real), np.full_like(y, c.imag)
+
+    if interior is not None:
+        outside = ~interior(cx, cy)
+        idx, x, y, cx, cy = idx[outside], x[outside], y[outside], cx[outside], cy[outside]
+
+    if smooth:
+        bailout = max(bailout, SMOOTH_BAILOUT)
+    radius2 = bailout * bailout
+
+    # Finished points are parked at z = c = 0, which is a fixed point of every
+    # step, and only compacted away once enough of them pile up.
+    live = np.ones(idx.size, dtype=bool)
+    stale = 0
+    saved_x, saved_y = x.copy(), y.copy()
+    next_save = CYCLE_CHECK
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for i in range(1, max_iter + 1):
+            if idx.size == 0:
+                break
+            x, y = step(x, y, cx, cy)
+            mag2 = x * x
+            mag2 += y * y
+
+            escaped = mag2 > radius2
+            n = np.count_nonzero(escaped)
+            if n:
+                counts[idx[escaped]] = _escape_count(i, mag2[escaped], smooth, bailout, power)
+                x[escaped] = y[escaped] = cx[escaped] = cy[escaped] = 0
+                live[escaped] = False
+                stale += n
+
+            if i % CYCLE_CHECK == 0:
+                dx = x - saved_x
+                dy = y - saved_y
+                dx *= dx
+                dy *= dy
+                dx += dy
+                cycled = (dx < CYCLE_EPSILON) & live
+                stale += np.count_nonzero(cycled)
+                live &= ~cycled
+
+            if stale * 4 > idx.size:
+                idx, x, y, cx, cy = idx[live], x[live], y[live], cx[live], cy[live]
+                saved_x, saved_y = saved_x[live], saved_y[live]
+                live = np.ones(idx.size, dtype=bool)
+                stale = 0
+
+            if i == next_save:
+                saved_x, saved_y = x.copy(), y.copy()
+                next_save *= 2
+
+    return np.clip(counts, 0, max_iter).reshape(shape)
+
+def reference_orbit(cx, cy, step, max_iter, bailout, digits):
+    """The orbit of c = cx + cy*i computed with `digits` of precision,
+    rounded to float64. Stops early if the orbit escapes."""
+    with localcontext() as ctx:
+        ctx.prec = digits
+        cx, cy = Decimal(cx), Decimal(cy)
+        x = y = Decimal(0)
+        radius2 = Decimal(bailout * bailout)
+        orbit = [(0.0, 0.0)]
+        for _ in range(max_iter):
+            x, y = step(x, y, cx, cy)
+            orbit.append((float(x), float(y)))
+            if x * x + y * y > radius2:
+                break
+    orbit = np.array(orbit)
+    return orbit[:, 0].copy(), orbit[:, 1].copy()
+
+def perturbed_escape_time(dcx, dcy, ref_x, ref_y, delta_step, max_iter=100, power=2, smooth=False, bailout=2.0):
+    """Iteration counts for points given as float64 offsets (dcx, dcy) from
+    the c of a high precision reference orbit.
+
+    Each point follows the reference orbit and rebases onto its start when
+    its offset grows larger than the orbit itself or the reference runs out,
+    which avoids the glitches plain perturbation produces.
+    """
+    shape = dcx.shape
+    counts = np.full(dcx.size, float(max_iter))
+    idx = np.arange(dcx.size)
+    dcx, dcy = dcx.ravel().copy(), dcy.ravel().copy()
+    dx, dy = np.zeros_like(dcx), np.zeros_like(dcy)
+    m = np.zeros(dcx.size, dtype=np.intp)
+    last = ref_x.size - 1
+
+    if smooth:
+        bailout = max(bailout, SMOOTH_BAILOUT)
+    radius2 = bailout * bailout
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for i in range(1, max_iter + 1):
+            if idx.size == 0:
+                break
+            dx, dy = delta_step(ref_x[m], ref_y[m], dx, dy, dcx, dcy)
+            m += 1
+            x = ref_x[m] + dx
+            y = ref_y[m] + dy
+            mag2 = x * x + y * y
+
+            escaped = mag2 > radius2
+            if escaped.any():
+                counts[idx[escaped]] = _escape_count(i, mag2[escaped], smooth, bailout, power)
+                keep = ~escaped
+                idx, dx, dy, dcx, dcy, m = idx[keep], dx[keep], dy[keep], dcx[keep], dcy[keep], m[keep]
+                x, y, mag2 = x[keep], y[keep], mag2[keep]
+
+            rebase = (mag2 < dx * dx + dy * dy) | (m == last)
+            if rebase.any():
+                dx[rebase] = x[rebase]
+                dy[rebase] = y[rebase]
+                m[rebase] = 0
+
+    return np.clip(counts, 0, max_iter).reshape(shape)
+
+def render_tiles(width, height, render_tile, tile_size=TILE_SIZE, progress=None):
+    """Calls render_tile(rows, cols) for every tile of the image in parallel,
+    on as many threads as this process's share of the cores, and stitches
+    the resulting arrays back together. `progress`, if given, is called with
+    the fraction of tiles done after each one."""
+    out = np.empty((height, width))
+    tiles = [
+        (slice(y, min(y + tile_size, height)), slice(x, min(x + tile_size, width)))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+    done = 0
+    lock = threading.Lock()
+
+    def run(tile):
+        nonlocal done
+        out[tile] = render_tile(*tile)
+        if progress:
+            with lock:
+                done += 1
+                progress(done / len(tiles))
+
+    with ThreadPoolExecutor(max_workers=min(len(tiles), workers.threads())) as pool:
+        list(pool.map(run, tiles))
+    return out
+
+def to_image(counts, max_iter):
+    shade = 255 - (counts * 255 / max_iter).astype(np.uint8)
+    return Image.fromarray(shade).convert("RGB")
+
+def escape_time_image(width, height, step, center, extent, zoom=1, max_iter=100,
+                      perturbation=None, progress=None, **kwargs):
+    """Render the view of `extent` (at zoom 1) around `center`.
+
+    Center coordinates may be strings so deep zooms can be given more digits
+    than a float holds. When the pixel spacing gets too small for float64 and
+    the fractal has a `perturbation` (reference step, delta step) pair, the
+    image is rendered by perturbation around a high precision orbit of the
+    center instead.
+    """
+    center_x, center_y = Decimal(str(center[0])), Decimal(str(center[1]))
+    span_x, span_y = extent[0] / zoom, extent[1] / zoom
+    offsets_x = (np.arange(width) / width - 0.5) * span_x
+    offsets_y = (np.arange(height) / height - 0.5) * span_y
+    magnitude = max(abs(float(center_x)), abs(float(center_y)), 1.0)
+
+    if perturbation and min(span_x / width, span_y / height) < PRECISION_LIMIT * magnitude:
+        reference_step, delta_step = perturbation
+        bailout = max(kwargs.get("bailout", 2.0), SMOOTH_BAILOUT if kwargs.get("smooth") else 0)
+        digits = int(np.log10(max(zoom, 1))) + 20
+        ref_x, ref_y = reference_orbit(center_x, center_y, reference_step, max_iter, bailout, digits)
+        kwargs.pop("interior", None)
+        dcx, dcy = np.meshgrid(offsets_x, offsets_y)
+
+        def render_tile(rows, cols):
+            return perturbed_escape_time(dcx[rows, cols], dcy[rows, cols], ref_x, ref_y, delta_step,
+                                         max_iter=max_iter, **kwargs)
+    else:
+        xs, ys = np.meshgrid(offsets_x + float(center_x), offsets_y + float(center_y))
+
+        def render_tile(rows, cols):
+            return escape_time(xs[rows, cols], ys[rows, cols], step, max_iter=max_iter, **kwargs)
+
+    return to_image(render_tiles(width, height, render_tile, progress=progress), max_iter)
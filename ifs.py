@@ -0,0 +1,119 @@
+import numpy as np
+from PIL import Image, ImageColor
+
+# An iterated function system is a list of affine maps (a, b, c, d, e, f):
+#   x' = a*x + b*y + e
+#   y' = c*x + d*y + f
+# in coordinates with y pointing up.
+SIERPINSKI_TRIANGLE = [
+    (0.5, 0, 0, 0.5, 0, 0),
+    (0.5, 0, 0, 0.5, 0.5, 0),
+    (0.5, 0, 0, 0.5, 0.25, 0.5),
+]
+BARNSLEY_FERN = [
+    (0, 0, 0, 0.16, 0, 0),
+    (0.85, 0.04, -0.04, 0.85, 0, 1.6),
+    (0.2, -0.26, 0.23, 0.22, 0, 1.6),
+    (-0.15, 0.28, 0.26, 0.24, 0, 0.44),
+]
+BARNSLEY_FERN_WEIGHTS = [0.01, 0.85, 0.07, 0.07]
+SIERPINSKI_CARPET = [
+    (1 / 3, 0, 0, 1 / 3, x / 3, y / 3)
+    for y in range(3) for x in range(3) if (x, y) != (1, 1)
+]
+
+# The chaos game runs this many independent walkers side by side, so each
+# NumPy step plots a whole batch of points. They all start on the attractor
+# but take BURN_IN steps to spread over it before anything is plotted.
+WALKERS = 1 << 18
+BURN_IN = 16
+
+# Bounds for fitting the attractor to the image come from a smaller, longer
+# pilot run, so extremities that take many steps to reach are included.
+PILOT_WALKERS = 1024
+PILOT_STEPS = 256
+MARGIN = 0.02
+
+
+def default_weights(maps):
+    """Pick each map in proportion to the area it covers, so the attractor
+    fills in evenly."""
+    return [max(abs(a * d - b * c), 0.01) for a, b, c, d, _, _ in maps]
+
+
+def _fixed_point(maps):
+    # The fixed point of any of the maps lies on the attractor.
+    for a, b, c, d, e, f in maps:
+        m = np.array([[1 - a, -b], [-c, 1 - d]])
+        if abs(np.linalg.det(m)) > 1e-12:
+            return np.linalg.solve(m, [e, f])
+    return np.zeros(2)
+
+
+def density(width, height, maps, points, rng, weights=None, bounds=None, progress=None):
+    """Hit counts per pixel for `points` points of the chaos game.
+
+    `bounds` (x0, y0, x1, y1) is stretched to fill the image; without it the
+    attractor is fitted to the image with its aspect ratio kept.
+    """
+    coefficients = np.asarray(maps, dtype=float)
+    if coefficients.ndim != 2 or coefficients.shape[1] != 6:
+        raise ValueError("Maps must be a list of (a, b, c, d, e, f) tuples.")
+    weights = np.asarray(weights if weights is not None else default_weights(maps), dtype=float)
+    if len(weights) != len(coefficients) or weights.min() < 0 or weights.sum() <= 0:
+        raise ValueError("Weights must be one non-negative number per map.")
+    cumulative = np.cumsum(weights) / weights.sum()
+
+    x0, y0 = _fixed_point(maps)
+
+    def step(x, y):
+        k = np.minimum(np.searchsorted(cumulative, rng.random(len(x)), side="right"), len(coefficients) - 1)
+        a, b, c, d, e, f = coefficients[k].T
+        return a * x + b * y + e, c * x + d * y + f
+
+    if bounds is None:
+        x, y = np.full(PILOT_WALKERS, x0), np.full(PILOT_WALKERS, y0)
+        left, right, bottom, top = x0, x0, y0, y0
+        for _ in range(PILOT_STEPS):
+            x, y = step(x, y)
+            left, right = min(left, x.min()), max(right, x.max())
+            bottom, top = min(bottom, y.min()), max(top, y.max())
+        scale = min((width - 1) / max(right - left, 1e-12), (height - 1) / max(top - bottom, 1e-12)) * (1 - 2 * MARGIN)
+        scale_x = scale_y = scale
+        center_x, center_y = (left + right) / 2, (bottom + top) / 2
+    else:
+        left, bottom, right, top = bounds
+        scale_x, scale_y = (width - 1) / (right - left), (height - 1) / (top - bottom)
+        center_x, center_y = (left + right) / 2, (bottom + top) / 2
+
+    walkers = max(min(WALKERS, points), 1)
+    x, y = np.full(walkers, x0), np.full(walkers, y0)
+    for _ in range(BURN_IN):
+        x, y = step(x, y)
+
+    counts = np.zeros(width * height, dtype=np.int64)
+    done = 0
+    while done < points:
+        x, y = step(x, y)
+        n = min(walkers, points - done)
+        px = np.rint((x[:n] - center_x) * scale_x + (width - 1) / 2).astype(np.intp)
+        py = np.rint((center_y - y[:n]) * scale_y + (height - 1) / 2).astype(np.intp)
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        counts += np.bincount(py[inside] * width + px[inside], minlength=width * height)
+        done += n
+        if progress:
+            progress(done / points)
+    return counts.reshape(height, width)
+
+
+def to_image(counts, color="white", log=True):
+    """Shade pixels by hit count, on a log scale unless `log` is False."""
+    peak = counts.max()
+    if peak == 0:
+        shade = np.zeros(counts.shape)
+    elif log:
+        shade = np.log1p(counts) / np.log1p(peak)
+    else:
+        shade = counts / peak
+    rgb = np.asarray(ImageColor.getrgb(color) if isinstance(color, str) else color, dtype=float)[:3]
+    return Image.fromarray((shade[..., np.newaxis] * rgb).astype(np.uint8))
@@ -0,0 +1,246 @@
+"""The registries of image generators and effects, the plugins that fill
+them, and the worker jobs that run them.
+
+Nothing here touches Discord, so modes can be imported and run on their own,
+e.g. by bench.py.
+"""
+import functools
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import io
+import os
+import pkgutil
+import sys
+import time
+
+from PIL import Image
+
+import encoding
+import parameters
+from lazy import LazyModule
+from parameters import Param, Schema
+
+IMAGE_GENERATORS = {}
+IMAGE_EFFECTS = {}
+
+PLUGIN_PACKAGE = "plugins"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# === Rendering ===
+
+def render_encoded(output, func, *args, **kwargs):
+    """Render and encode in one worker job. Returns the encoded bytes and
+    the render and encode times."""
+    start = time.perf_counter()
+    img = func(*args, **kwargs)
+    rendered = time.perf_counter()
+    data = encoding.encode(img, **output)
+    return data, rendered - start, time.perf_counter() - rendered
+
+def save_animation(frames, durations, loop, format, quality=None, compress=None):
+    """Encode a list of frames as an animated GIF, WEBP or PNG (APNG).
+    `quality` applies to WEBP, with 100 being lossless, and `compress` (0-9)
+    is the PNG compress_level."""
+    buf = io.BytesIO()
+    if format == "WEBP":
+        options = {"lossless": True} if quality == 100 else {"quality": quality or 80, "method": 4}
+    elif format == "PNG":
+        options = {} if compress is None else {"compress_level": compress}
+    else:
+        options = {"optimize": True}
+    frames[0].save(buf, format=format, save_all=True, append_images=frames[1:],
+                   duration=durations, loop=loop, **options)
+    return buf.getvalue()
+
+def apply_effects_frames(frames, stages):
+    return [apply_effects(frame, stages) for frame in frames]
+
+def apply_lut(img, stages):
+    # Point-wise effects map each channel value on its own, so running them
+    # over a 0..255 ramp gives one lookup table for the whole run.
+    if len(stages) == 1:
+        func, kwargs = stages[0]
+        return func(img, **kwargs)
+    ramp = Image.new("RGB", (256, 1))
+    ramp.putdata([(i, i, i) for i in range(256)])
+    for func, kwargs in stages:
+        ramp = func(ramp, **kwargs)
+    lut = [value for band in ramp.convert("RGB").split() for value in band.getdata()]
+    return img.convert("RGB").point(lut)
+
+def apply_effects(img, stages, progress=None):
+    run = []
+    for i, (mode, kwargs) in enumerate(stages):
+        func = IMAGE_EFFECTS[mode]
+        if func.pointwise:
+            run.append((func, kwargs))
+            continue
+        if run:
+            img = apply_lut(img, run)
+            run = []
+        img = func(img, **kwargs)
+        if progress:
+            progress((i + 1) / len(stages))
+    if run:
+        img = apply_lut(img, run)
+    return img
+
+# `cacheable=False` marks modes whose output can differ between identical
+# calls; `seeded=True` marks modes that are only repeatable given a seed.
+# `cost` estimates a generator's work for the scheduler from the same
+# arguments; by default it is one unit per pixel. `progress=True` marks
+# generators that take a `progress` callable and call it with the fraction
+# done as they go. `params` declares Params for keyword parameters whose
+# type or bounds don't follow from their default; every value a command
+# passes is converted and clamped by the resulting schema first.
+
+# One cost unit is one escape-time iteration of one pixel. Measured on one
+# core, a chaos-game point takes as long as about 200 of those, and an
+# L-system segment (expanded, traced and drawn) about 1000.
+POINT_COST = 200
+SEGMENT_COST = 1000
+
+def pixel_cost(width, height, **kwargs):
+    return width * height
+
+def iteration_cost(width, height, max_iter=100, **kwargs):
+    return width * height * max(int(max_iter), 1)
+
+def point_cost(default):
+    """Cost of plotting `iterations` points, `default` unless given."""
+    return lambda width, height, iterations=default, **kwargs: width * height + POINT_COST * int(iterations)
+
+# `help` is the line shown for the mode in its command's help, by default
+# the function's docstring.
+
+def register_generator(name, cacheable=True, seeded=False, cost=pixel_cost, progress=False, params=None, help=None):
+    def decorator(func):
+        func.cacheable = cacheable
+        func.seeded = seeded
+        func.cost = cost
+        func.reports_progress = progress
+        func.params = Schema.from_function(func, params, skip=("width", "height", "progress"))
+        func.help = help or inspect.getdoc(func) or ""
+        IMAGE_GENERATORS[name] = func
+        return func
+    return decorator
+
+# `pointwise=True` marks effects that map every channel value independently
+# of every other pixel, which lets chains of them be fused into one pass.
+# Effects that change the image size give `size`, called as
+# size((width, height), **kwargs) to get the size they output.
+
+def same_size(size, **kwargs):
+    return size
+
+def register_effect(name, cacheable=True, seeded=False, pointwise=False, size=same_size, params=None, help=None):
+    def decorator(func):
+        func.cacheable = cacheable
+        func.seeded = seeded
+        func.pointwise = pointwise
+        func.size = size
+        func.params = Schema.from_function(func, params, skip=("img",))
+        func.help = help or inspect.getdoc(func) or ""
+        IMAGE_EFFECTS[name] = func
+        return func
+    return decorator
+
+
+# Params shared by modes across plugins.
+SEED = Param(int, 0)
+COLOR = Param(parameters.color)
+
+# === Plugins ===
+
+# Every module in the plugins package registers its modes when imported.
+# Plugins refer to the modules that do the actual work through LazyModule,
+# so loading them only reads metadata, and numpy and friends are imported
+# by whichever process first renders something.
+
+def load_plugins():
+    """Import every plugin module that isn't imported yet. Returns them all."""
+    package = importlib.import_module(PLUGIN_PACKAGE)
+    return [importlib.import_module(f"{PLUGIN_PACKAGE}.{info.name}")
+            for info in pkgutil.iter_modules(package.__path__)]
+
+def reload_plugins():
+    """Import the plugins afresh, along with the modules of this project they
+    use, replacing every registered mode. New plugin modules are picked up
+    and the modes of deleted ones dropped. If a plugin fails to import, the
+    previous plugins and modes are put back and the error is raised.
+    Returns the names of the reloaded modules."""
+    old = {name: module for name, module in sys.modules.items() if name.startswith(PLUGIN_PACKAGE + ".")}
+    registered = dict(IMAGE_GENERATORS), dict(IMAGE_EFFECTS)
+    used = sorted({value.__name__ for module in old.values() for value in vars(module).values()
+                   if isinstance(value, LazyModule)})
+    reloaded = []
+    for name in used:
+        module = sys.modules.get(name)
+        if module is not None and os.path.dirname(os.path.abspath(module.__file__)) == HERE:
+            reloaded.append(importlib.reload(module).__name__)
+
+    IMAGE_GENERATORS.clear()
+    IMAGE_EFFECTS.clear()
+    for name in old:
+        del sys.modules[name]
+    importlib.invalidate_caches()
+    try:
+        plugins = load_plugins()
+    except BaseException:
+        for name in [name for name in sys.modules if name.startswith(PLUGIN_PACKAGE + ".")]:
+            del sys.modules[name]
+        sys.modules.update(old)
+        for registry, modes in zip((IMAGE_GENERATORS, IMAGE_EFFECTS), registered):
+            registry.clear()
+            registry.update(modes)
+        raise
+    code_version.cache_clear()
+    return reloaded + [module.__name__ for module in plugins]
+
+@functools.cache
+def code_version():
+    """Hash of the source of everything that renders: this module, encoding,
+    the plugins and the modules of this project they use. Render cache keys
+    include it, so a code change never serves renders made before it."""
+    names = {__name__, encoding.__name__}
+    for name, module in [*sys.modules.items()]:
+        if name.startswith(PLUGIN_PACKAGE + "."):
+            names.add(name)
+            names.update(value.__name__ for value in vars(module).values() if isinstance(value, LazyModule))
+    h = hashlib.sha256()
+    for name in sorted(names):
+        spec = importlib.util.find_spec(name)
+        if spec.origin and os.path.dirname(os.path.abspath(spec.origin)) in (HERE, os.path.join(HERE, PLUGIN_PACKAGE)):
+            with open(spec.origin, "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+    return h.hexdigest()[:16]
+
+def _describe(name, param):
+    if param.default is None:
+        return f"[{name}]"
+    default = param.default
+    return f"[{name}={str(default).strip('()') if isinstance(default, complex) else default}]"
+
+def help_text(registry):
+    """Help for every mode in `registry`, grouped by the plugin it came from.
+    Each group starts with the plugin's docstring and the parameters all of
+    its modes share, followed by each mode's help and its other parameters."""
+    groups = {}
+    for name, func in registry.items():
+        groups.setdefault(func.__module__, []).append((name, func))
+    lines = []
+    for module, modes in groups.items():
+        described = [[_describe(k, param) for k, param in func.params.params.items()] for _, func in modes]
+        shared = [p for p in described[0] if all(p in params for params in described)] if len(modes) > 1 else []
+        title, _, notes = (inspect.getdoc(sys.modules[module]) or module).partition("\n")
+        lines.append(f"{title}:" + (f" (All take {' '.join(shared)})" if shared else ""))
+        lines += notes.strip().splitlines()
+        for (name, func), params in zip(modes, described):
+            lines.append(f'"{name}": {func.help}')
+            rest = [p for p in params if p not in shared]
+            if rest:
+                lines.append("  " + " ".join(rest))
+        lines.append("")
+    return "\n".join(lines).rstrip()
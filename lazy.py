@@ -0,0 +1,16 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module, importing it the first time one of its
+    attributes is used. Importing whatever refers to it stays cheap, and
+    processes that never use it never pay for it."""
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self.__name__!r}>"
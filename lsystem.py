@@ -0,0 +1,101 @@
+from collections import Counter
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageColor, ImageDraw
+
+from lazy import LazyModule
+
+# Only drawing needs numpy; counting segments, which the bot does to bound
+# and cost requests, doesn't.
+np = LazyModule("numpy")
+
+# Curves with more segments than this are refused rather than expanded.
+MAX_SEGMENTS = 4_000_000
+MARGIN = 0.1
+
+
+@dataclass
+class LSystem:
+    """A string rewriting system read as turtle moves: symbols in `draw`
+    step forward one unit, "+" and "-" turn left and right by `angle`
+    degrees, and anything else is ignored. `angle` must divide 360."""
+    axiom: str
+    rules: dict
+    angle: int
+    draw: str = "F"
+    _table: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._table = str.maketrans(self.rules)
+
+    def segments(self, iterations):
+        """Number of forward steps after `iterations` rewrites, counted
+        without expanding the string. Counting stops early once it passes
+        MAX_SEGMENTS."""
+        counts = Counter(self.axiom)
+        for _ in range(iterations):
+            grown = Counter()
+            for symbol, count in counts.items():
+                for out in self.rules.get(symbol, symbol):
+                    grown[out] += count
+            counts = grown
+            if sum(counts[symbol] for symbol in self.draw) > MAX_SEGMENTS:
+                break
+        return sum(counts[symbol] for symbol in self.draw)
+
+    def max_iterations(self):
+        """Most iterations whose curve stays within MAX_SEGMENTS."""
+        n = 0
+        while self.segments(n) < self.segments(n + 1) <= MAX_SEGMENTS:
+            n += 1
+        return n
+
+    def expand(self, iterations):
+        if self.segments(iterations) > MAX_SEGMENTS:
+            raise ValueError(f"That many iterations would draw over {MAX_SEGMENTS:,} segments.")
+        text = self.axiom
+        for _ in range(iterations):
+            text = text.translate(self._table)
+        return text
+
+    def points(self, iterations):
+        """Vertices of the curve as an (n, 2) array, y pointing up."""
+        symbols = np.frombuffer(self.expand(iterations).encode(), dtype=np.uint8)
+        # Headings are whole numbers of turns, so they never drift.
+        turns = 360 // self.angle
+        turn = (symbols == ord("+")).astype(np.int64) - (symbols == ord("-"))
+        heading = np.cumsum(turn) % turns
+        forward = np.isin(symbols, np.frombuffer(self.draw.encode(), dtype=np.uint8))
+        angles = np.arange(turns) * (2 * np.pi / turns)
+        steps = heading[forward]
+        points = np.zeros((len(steps) + 1, 2))
+        points[1:, 0] = np.cumsum(np.cos(angles)[steps])
+        points[1:, 1] = np.cumsum(np.sin(angles)[steps])
+        return points
+
+
+KOCH_SNOWFLAKE = LSystem("F++F++F", {"F": "F-F++F-F"}, 60)
+HILBERT = LSystem("A", {"A": "+BF-AFA-FB+", "B": "-AF+BFB+FA-"}, 90)
+DRAGON = LSystem("F", {"F": "F+G", "G": "F-G"}, 90, draw="FG")
+LEVY_C = LSystem("F", {"F": "+F--F+"}, 45)
+
+
+def to_image(points, width, height, color="white", thickness=1, antialias=2):
+    """Draw the curve through `points`, fitted to the image, as one polyline.
+    With `antialias` above 1 it is drawn that many times larger and scaled
+    down."""
+    scale = max(int(antialias), 1)
+    big_width, big_height = width * scale, height * scale
+    low, high = points.min(axis=0), points.max(axis=0)
+    span = np.maximum(high - low, 1e-12)
+    fit = min(big_width / span[0], big_height / span[1]) * (1 - MARGIN)
+    xy = (points - (low + high) / 2) * fit
+    xy[:, 1] = -xy[:, 1]
+    xy += (big_width / 2, big_height / 2)
+
+    img = Image.new("RGB", (big_width, big_height), "black")
+    fill = ImageColor.getrgb(color) if isinstance(color, str) else tuple(color)
+    ImageDraw.Draw(img).line(xy.ravel().tolist(), fill=fill, width=max(int(thickness * scale), 1))
+    if scale > 1:
+        img = img.resize((width, height), Image.Resampling.BOX)
+    return img
@@ -0,0 +1,145 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import os
+import time
+
+from aiohttp import web
+
+# Histogram bucket upper bounds in seconds, from 1 ms to about 3 minutes,
+# each sqrt(2) wider than the last. Percentiles are interpolated within a
+# bucket, so they are good to a few tens of percent, which is plenty to
+# tell a 50 ms render from a 5 s one.
+BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(36))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return 0.0
+
+
+def _series(metric, labels):
+    if not labels:
+        return metric
+    return metric + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """Latency histograms and counters, each kept per name and set of
+    labels, e.g. observe("render", 0.2, mode="mandelbrot"). Everything is
+    recorded from the event loop thread."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.histograms = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+        self._watcher = None
+
+    def observe(self, name, seconds, **labels):
+        self.histograms[name, tuple(sorted(labels.items()))].observe(seconds)
+
+    def add(self, name, amount=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def watch_loop(self, interval):
+        """Start recording how late the event loop wakes from a sleep of
+        `interval` seconds, as "loop_lag"."""
+        self._watcher = asyncio.get_running_loop().create_task(self._watch_loop(interval))
+
+    async def _watch_loop(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.observe("loop_lag", max(loop.time() - start - interval, 0.0))
+
+    def summary(self, names=None):
+        """Text table of counts and percentiles in ms, busiest first."""
+        lines = []
+        rows = sorted(self.histograms.items(), key=lambda item: (item[0][0], -item[1].count))
+        for (name, labels), h in rows:
+            if names and name not in names:
+                continue
+            label = " ".join(str(v) for _, v in labels)
+            percentiles = " ".join(f"p{q * 100:g} {h.quantile(q) * 1000:.0f}" for q in QUANTILES)
+            lines.append(f"{name} {label}".rstrip() + f": {h.count}x, {percentiles}, max {h.max * 1000:.0f} ms")
+        for (name, labels), n in sorted(self.counters.items()):
+            if names and name not in names:
+                continue
+            label = " ".join(str(v) for _, v in labels)
+            lines.append(f"{name} {label}".rstrip() + f": {n:,}")
+        return "\n".join(lines) or "nothing yet"
+
+    def prometheus(self):
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+        for (name, labels), h in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip((*BUCKETS, "+Inf"), h.buckets):
+                cumulative += n
+                le = bound if isinstance(bound, str) else f"{bound:.6g}"
+                lines.append(f"{_series(metric + '_bucket', (*labels, ('le', le)))} {cumulative}")
+            lines.append(f"{_series(metric + '_sum', labels)} {h.sum}")
+            lines.append(f"{_series(metric + '_count', labels)} {h.count}")
+        for (name, labels), n in sorted(self.counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{_series(metric, labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write prometheus() to `path`, replacing it in one step so readers
+        never see half a file."""
+        with open(path + ".tmp", "w") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve prometheus() at http://host:port/metrics."""
+        async def handle(request):
+            return web.Response(body=self.prometheus().encode(),
+                                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,65 @@
+import numpy as np
+from PIL import Image
+
+
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+def _lattice(size, scale):
+    # Lattice cell of every pixel along one axis and the pixel's position in it.
+    pos = np.arange(size) / scale
+    cell = np.floor(pos).astype(np.intp)
+    return cell, pos - cell
+
+def value_noise(width, height, scale, rng):
+    """Smoothly interpolated random values on a lattice `scale` pixels apart,
+    in [0, 1]."""
+    scale = max(scale, 1)
+    x0, fx = _lattice(width, scale)
+    y0, fy = _lattice(height, scale)
+    values = rng.random((y0[-1] + 2, x0[-1] + 2))
+
+    u = _fade(fx)[np.newaxis, :]
+    v = _fade(fy)[:, np.newaxis]
+    top = values[np.ix_(y0, x0)] * (1 - u) + values[np.ix_(y0, x0 + 1)] * u
+    bottom = values[np.ix_(y0 + 1, x0)] * (1 - u) + values[np.ix_(y0 + 1, x0 + 1)] * u
+    return top * (1 - v) + bottom * v
+
+def perlin(width, height, scale, rng):
+    """Perlin gradient noise with lattice spacing `scale` pixels, in [0, 1]."""
+    scale = max(scale, 1)
+    x0, fx = _lattice(width, scale)
+    y0, fy = _lattice(height, scale)
+    angles = rng.uniform(0, 2 * np.pi, (y0[-1] + 2, x0[-1] + 2))
+    gx, gy = np.cos(angles), np.sin(angles)
+
+    fx = fx[np.newaxis, :]
+    fy = fy[:, np.newaxis]
+
+    def corner(dx, dy):
+        rows, cols = np.ix_(y0 + dy, x0 + dx)
+        return gx[rows, cols] * (fx - dx) + gy[rows, cols] * (fy - dy)
+
+    u = _fade(fx)
+    v = _fade(fy)
+    top = corner(0, 0) * (1 - u) + corner(1, 0) * u
+    bottom = corner(0, 1) * (1 - u) + corner(1, 1) * u
+    # 2D Perlin noise stays within +-sqrt(1/2).
+    return (top * (1 - v) + bottom * v) * np.sqrt(0.5) + 0.5
+
+def fbm(width, height, scale, rng, octaves=5, persistence=0.5, lacunarity=2.0):
+    """Fractional Brownian motion: octaves of Perlin noise, each finer by
+    `lacunarity` and weaker by `persistence`, in [0, 1]."""
+    total = np.zeros((height, width))
+    amplitude = 1.0
+    norm = 0.0
+    for _ in range(octaves):
+        total += amplitude * perlin(width, height, scale, rng)
+        norm += amplitude
+        amplitude *= persistence
+        scale /= lacunarity
+    return total / norm
+
+def to_image(values):
+    shade = (np.clip(values, 0, 1) * 255).astype(np.uint8)
+    return Image.fromarray(shade).convert("RGB")
@@ -0,0 +1,201 @@
+import ast
+import inspect
+import math
+from dataclasses import dataclass, replace
+from decimal import Decimal, InvalidOperation
+
+from PIL import ImageColor
+
+# Longest value the literal parser will look at, and most items in a list.
+MAX_LITERAL_CHARS = 1000
+MAX_ITEMS = 32
+
+
+class ParamError(ValueError):
+    """Raised for a parameter that is unknown or can't be read."""
+
+
+def literal(text):
+    """Read a Python literal (number, string, bool, tuple, list...) from
+    `text`, or return the text unchanged if it isn't one. Nothing is ever
+    evaluated, so `10**10**8` is just text."""
+    if len(text) > MAX_LITERAL_CHARS:
+        raise ValueError(f"is longer than {MAX_LITERAL_CHARS} characters")
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def _read(value):
+    return literal(value) if isinstance(value, str) else value
+
+
+def _finite(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("must be a number")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("must be finite")
+    return value
+
+
+# Converters take a raw string or an already typed value and return the
+# value in its one canonical form, so equal requests normalize equally.
+
+def integer(value):
+    value = _finite(_read(value))
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError("must be a whole number")
+    return int(value)
+
+def number(value):
+    return float(_finite(_read(value)))
+
+def boolean(value):
+    value = _read(value)
+    if isinstance(value, str):
+        value = {"true": True, "yes": True, "on": True, "false": False, "no": False, "off": False}.get(value.lower())
+    if value not in (True, False):
+        raise ValueError("must be True or False")
+    return bool(value)
+
+def complex_number(value):
+    value = _read(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float, complex)):
+        raise ValueError("must be a complex number, e.g. -0.8+0.156j")
+    value = complex(value)
+    if not (math.isfinite(value.real) and math.isfinite(value.imag)):
+        raise ValueError("must be finite")
+    return value
+
+def text(value):
+    if isinstance(value, str):
+        quoted = literal(value)
+        return quoted if isinstance(quoted, str) else value
+    return str(value)
+
+def coordinate(value):
+    """A number kept to every digit given, for deep fractal zooms. Strings
+    are read as decimals directly rather than as floats."""
+    value = text(value).strip() if isinstance(value, str) else repr(_finite(value))
+    try:
+        value = Decimal(value)
+    except InvalidOperation:
+        raise ValueError("must be a number") from None
+    if not value.is_finite():
+        raise ValueError("must be finite")
+    return value.normalize()
+
+def color(value):
+    value = _read(value)
+    if isinstance(value, str):
+        try:
+            ImageColor.getrgb(value)
+        except ValueError:
+            raise ValueError("must be a color name, #rrggbb or an (r, g, b) tuple") from None
+        return value.lower()
+    if not isinstance(value, (tuple, list)) or len(value) != 3 or not all(
+            isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255 for c in value):
+        raise ValueError("must be a color name, #rrggbb or an (r, g, b) tuple")
+    return tuple(value)
+
+def numbers(value):
+    value = _read(value)
+    if not isinstance(value, (tuple, list)) or not 0 < len(value) <= MAX_ITEMS:
+        raise ValueError(f"must be a list of 1 to {MAX_ITEMS} numbers")
+    return tuple(float(_finite(v)) for v in value)
+
+def affine_maps(value):
+    value = _read(value)
+    if not isinstance(value, (tuple, list)) or not 0 < len(value) <= MAX_ITEMS:
+        raise ValueError(f"must be a list of 1 to {MAX_ITEMS} (a, b, c, d, e, f) tuples")
+    maps = []
+    for item in value:
+        if not isinstance(item, (tuple, list)) or len(item) != 6:
+            raise ValueError("must be a list of (a, b, c, d, e, f) tuples")
+        maps.append(tuple(float(_finite(v)) for v in item))
+    return tuple(maps)
+
+
+CONVERTERS = {int: integer, float: number, bool: boolean, complex: complex_number, str: text, Decimal: coordinate}
+
+
+@dataclass(frozen=True)
+class Param:
+    """One parameter: its type (a Python type or a converter function),
+    optional bounds that values are clamped to, its default and, for text,
+    the values it may take. A default of None means "not given" and is
+    passed on as None."""
+    type: object
+    min: object = None
+    max: object = None
+    default: object = inspect.Parameter.empty
+    choices: tuple = ()
+
+    def parse(self, name, value):
+        """Return the converted value and whether it had to be clamped."""
+        try:
+            value = CONVERTERS.get(self.type, self.type)(value)
+        except ValueError as e:
+            raise ParamError(f"`{name}` {e}.") from None
+        if self.choices:
+            value = value.lower()
+            if value not in self.choices:
+                raise ParamError(f"`{name}` must be one of `{', '.join(self.choices)}`.")
+        clamped = value
+        if self.min is not None and clamped < self.min:
+            clamped = self.min
+        if self.max is not None and clamped > self.max:
+            clamped = self.max
+        if clamped is not value:
+            clamped = CONVERTERS.get(self.type, self.type)(clamped)
+        return clamped, clamped != value
+
+
+class Schema:
+    """The keyword parameters a generator, effect or command accepts."""
+
+    def __init__(self, params):
+        self.params = params
+
+    @classmethod
+    def from_function(cls, func, params=None, skip=()):
+        """Schema for the keyword parameters of `func`, minus `skip`. Each
+        takes its Param from `params` if given there, and otherwise the type
+        of its default; defaults come from the signature unless the Param
+        has its own."""
+        params = dict(params or {})
+        schema = {}
+        for name, parameter in inspect.signature(func).parameters.items():
+            if name in skip or parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+                continue
+            param = params.pop(name, None)
+            if param is None:
+                if parameter.default is None or parameter.default is parameter.empty:
+                    raise TypeError(f"{func.__name__}() needs a Param for `{name}`")
+                param = Param(type(parameter.default))
+            if param.default is inspect.Parameter.empty:
+                param = replace(param, default=parameter.default)
+            schema[name] = param
+        if params:
+            raise TypeError(f"{func.__name__}() has no parameters `{', '.join(params)}`")
+        return cls(schema)
+
+    def normalize(self, values):
+        """Convert and clamp `values`, given as strings or typed values, and
+        fill in the defaults of the rest. Returns the kwargs, in schema
+        order, and a note for every value that was clamped."""
+        for name in values:
+            if name not in self.params:
+                raise ParamError(f"Unknown parameter `{name}`. Parameters: `{', '.join(self.params) or 'none'}`")
+        kwargs = {}
+        notes = []
+        for name, param in self.params.items():
+            value = values.get(name, param.default)
+            if value is None:
+                kwargs[name] = None
+                continue
+            kwargs[name], clamped = param.parse(name, value)
+            if clamped:
+                notes.append(f"`{name}` was clamped to {kwargs[name]}.")
+        return kwargs, notes
@@ -0,0 +1,3 @@
+"""Image generators and effects. Each module registers its modes with
+images.register_generator or images.register_effect; its docstring heads
+its modes in the command help. images.load_plugins imports them all."""
@@ -0,0 +1,43 @@
+"""Chaos game
+Points are shaded by density, on a log scale unless [log=False]."""
+import parameters
+from images import COLOR, SEED, point_cost, register_generator
+from lazy import LazyModule
+from parameters import Param
+
+np = LazyModule("numpy")
+ifs = LazyModule("ifs")
+
+CHAOS_PARAMS = {"iterations": Param(int, 1, 50_000_000), "color": COLOR, "seed": SEED}
+
+@register_generator("sierpinski_triangle", seeded=True, cost=point_cost(10000), progress=True, params=CHAOS_PARAMS)
+def generate_sierpinski(width=256, height=256, iterations=10000, color="white", log=True, seed=None, progress=None, **kwargs):
+    """A triangle made of ever smaller triangles"""
+    counts = ifs.density(width, height, ifs.SIERPINSKI_TRIANGLE, iterations, np.random.default_rng(seed),
+                         bounds=(0, 0, 1, 1), progress=progress)
+    return ifs.to_image(counts, color, log)
+
+@register_generator("barnsley_fern", seeded=True, cost=point_cost(1_000_000), progress=True, params=CHAOS_PARAMS)
+def generate_barnsley_fern(width=256, height=256, iterations=1_000_000, color="lime", log=True, seed=None, progress=None, **kwargs):
+    """A fern leaf"""
+    counts = ifs.density(width, height, ifs.BARNSLEY_FERN, iterations, np.random.default_rng(seed),
+                         weights=ifs.BARNSLEY_FERN_WEIGHTS, progress=progress)
+    return ifs.to_image(counts, color, log)
+
+@register_generator("sierpinski_carpet", seeded=True, cost=point_cost(1_000_000), progress=True, params=CHAOS_PARAMS)
+def generate_sierpinski_carpet(width=256, height=256, iterations=1_000_000, color="white", log=True, seed=None, progress=None, **kwargs):
+    """A square with ever smaller square holes"""
+    counts = ifs.density(width, height, ifs.SIERPINSKI_CARPET, iterations, np.random.default_rng(seed),
+                         progress=progress)
+    return ifs.to_image(counts, color, log)
+
+@register_generator("ifs", seeded=True, cost=point_cost(1_000_000), progress=True,
+                    params={**CHAOS_PARAMS, "maps": Param(parameters.affine_maps),
+                            "weights": Param(parameters.numbers)})
+def generate_ifs(width=256, height=256, maps=None, weights=None, iterations=1_000_000, color="white", log=True, seed=None, progress=None, **kwargs):
+    """Your own affine [maps], a list of (a, b, c, d, e, f) for x'=ax+by+e, y'=cx+dy+f, picked by relative [weights]"""
+    if not maps:
+        raise ValueError("Give the affine maps, e.g. maps=[(0.5,0,0,0.5,0,0),(0.5,0,0,0.5,0.5,0),(0.5,0,0,0.5,0,0.5)]")
+    counts = ifs.density(width, height, maps, iterations, np.random.default_rng(seed),
+                         weights=weights, progress=progress)
+    return ifs.to_image(counts, color, log)
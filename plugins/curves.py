@@ -0,0 +1,40 @@
+"""Curves
+[antialias] draws the curve that many times larger and scales it down."""
+from images import COLOR, SEGMENT_COST, register_generator
+from lazy import LazyModule
+from parameters import Param
+
+# The bounds and costs below import lsystem as soon as the plugin loads;
+# that is cheap, as lsystem only imports numpy once a curve is drawn.
+lsystem = LazyModule("lsystem")
+
+def curve_cost(system, default):
+    """Cost of drawing an L-system curve, supersampled, after `iterations`
+    rewrites (`default` unless given)."""
+    def cost(width, height, iterations=default, antialias=2, **kwargs):
+        return width * height * max(int(antialias), 1) ** 2 + SEGMENT_COST * system.segments(int(iterations))
+    return cost
+
+def curve_params(system):
+    return {"iterations": Param(int, 0, system.max_iterations()), "color": COLOR,
+            "thickness": Param(int, 1, 32), "antialias": Param(int, 1, 4)}
+
+@register_generator("koch_snowflake", cost=curve_cost(lsystem.KOCH_SNOWFLAKE, 4), params=curve_params(lsystem.KOCH_SNOWFLAKE))
+def generate_koch_snowflake(width=512, height=512, iterations=4, color="white", thickness=1, antialias=2, **kwargs):
+    """A snowflake made of ever smaller triangle bumps"""
+    return lsystem.to_image(lsystem.KOCH_SNOWFLAKE.points(iterations), width, height, color, thickness, antialias)
+
+@register_generator("hilbert", cost=curve_cost(lsystem.HILBERT, 5), params=curve_params(lsystem.HILBERT))
+def generate_hilbert(width=256, height=256, iterations=5, color="white", thickness=1, antialias=2, **kwargs):
+    """A square-filling curve"""
+    return lsystem.to_image(lsystem.HILBERT.points(iterations), width, height, color, thickness, antialias)
+
+@register_generator("dragon", cost=curve_cost(lsystem.DRAGON, 12), params=curve_params(lsystem.DRAGON))
+def generate_dragon(width=256, height=256, iterations=12, color="white", thickness=1, antialias=2, **kwargs):
+    """The Heighway dragon, a self-similar folded strip"""
+    return lsystem.to_image(lsystem.DRAGON.points(iterations), width, height, color, thickness, antialias)
+
+@register_generator("levy_c", cost=curve_cost(lsystem.LEVY_C, 12), params=curve_params(lsystem.LEVY_C))
+def generate_levy_c(width=256, height=256, iterations=12, color="white", thickness=1, antialias=2, **kwargs):
+    """The Lévy C curve"""
+    return lsystem.to_image(lsystem.LEVY_C.points(iterations), width, height, color, thickness, antialias)
@@ -0,0 +1,85 @@
+"""Modes"""
+import io
+
+from PIL import Image, ImageOps, ImageFilter, ImageEnhance
+
+from images import register_effect
+from parameters import Param
+
+RESIZE_MAX = 2048
+
+@register_effect("mono")
+def effect_grayscale(img, **kwargs):
+    """Converts the image to grayscale"""
+    return img.convert("L").convert("RGB")
+
+@register_effect("invert", pointwise=True)
+def effect_invert(img, **kwargs):
+    """Inverts the color values of the image"""
+    return ImageOps.invert(img)
+
+@register_effect("blur", params={"radius": Param(float, 0, 100)})
+def effect_blur(img, radius=3, **kwargs):
+    """Blurs the image by [radius]"""
+    return img.filter(ImageFilter.GaussianBlur(radius))
+
+@register_effect("brightness", pointwise=True, params={"factor": Param(float, 0, 10)})
+def effect_brightness(img, factor=1.0, **kwargs):
+    """Increases the brightness of the image by [factor]"""
+    enhancer = ImageEnhance.Brightness(img)
+    return enhancer.enhance(factor)
+
+@register_effect("contrast", params={"factor": Param(float, 0, 10)})
+def effect_contrast(img, factor=1.0, **kwargs):
+    """Increases the contrast of the image by [factor]"""
+    enhancer = ImageEnhance.Contrast(img)
+    return enhancer.enhance(factor)
+
+@register_effect("pixelate", params={"scale": Param(int, 1, 256)})
+def effect_pixelate(img, scale=8, **kwargs):
+    """Enlarges the pixels of the image by [scale]"""
+    w, h = img.size
+    img = img.resize((max(w // scale, 1), max(h // scale, 1)), resample=Image.NEAREST)
+    return img.resize((w, h), resample=Image.NEAREST)
+
+@register_effect("posterize", pointwise=True, params={"bits": Param(int, 1, 8)})
+def effect_posterize(img, bits=4, **kwargs):
+    """Reduces the number of bits per color channel to [bits]"""
+    return ImageOps.posterize(img, bits)
+
+@register_effect("solarize", pointwise=True, params={"threshold": Param(int, 0, 255)})
+def effect_solarize(img, threshold=128, **kwargs):
+    """Inverts all pixels brighter than [threshold]"""
+    return ImageOps.solarize(img, threshold)
+
+@register_effect("jpegify", params={"quality": Param(int, 1, 100)})
+def effect_jpegify(img, quality=10, **kwargs):
+    """Converts an image to JPEG with [quality] (Still returns the image as PNG unless format= is given)
+    Low quality will have more JPEG compression artifacts"""
+    jpg_buf = io.BytesIO()
+    img.convert("RGB").save(jpg_buf, format="JPEG", quality=quality)
+    jpg_buf.seek(0)
+    return Image.open(jpg_buf).convert("RGB")
+
+def resized(size, width=None, height=None, **kwargs):
+    """Output size of resize. A side derived from the aspect ratio can be
+    far past RESIZE_MAX; then both sides are scaled down to fit."""
+    original_width, original_height = size
+
+    if width and not height:
+        height = original_height * width / original_width
+    elif height and not width:
+        width = original_width * height / original_height
+    elif not width and not height:
+        return size
+
+    scale = min(1, RESIZE_MAX / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+@register_effect("resize", size=resized, params={"width": Param(int, 1, RESIZE_MAX),
+                                                 "height": Param(int, 1, RESIZE_MAX)})
+def effect_resize(img, width=None, height=None, **kwargs):
+    """Resizes the image to [width]x[height], keeping the aspect ratio if only one is given"""
+    if not width and not height:
+        return img
+    return img.resize(resized(img.size, width, height), resample=Image.NEAREST)
@@ -0,0 +1,51 @@
+"""Fractals
+Move the view with [center_x] [center_y] [zoom]. mandelbrot/burning_ship zoom past float precision;
+coordinates keep every digit given, e.g. center_x=-1.74006238"""
+from decimal import Decimal
+
+from images import iteration_cost, register_generator
+from lazy import LazyModule
+from parameters import Param
+
+fractals = LazyModule("fractals")
+
+CENTER = Param(Decimal, -10, 10)
+FRACTAL_PARAMS = {"max_iter": Param(int, 1, 10_000), "center_x": CENTER, "center_y": CENTER,
+                  "zoom": Param(float, 1e-3, 1e100)}
+
+@register_generator("mandelbrot", cost=iteration_cost, progress=True, params=FRACTAL_PARAMS)
+def generate_mandelbrot(width=256, height=256, max_iter=100, center_x=-0.75, center_y=0, zoom=1, smooth=False, progress=None, **kwargs):
+    """Endlessly detailed bulbous blobs connected by thin filaments"""
+    return fractals.escape_time_image(width, height, fractals.mandelbrot_step, (center_x, center_y), (3.5, 2.5),
+                                      zoom=zoom, max_iter=max_iter, smooth=smooth, progress=progress,
+                                      interior=fractals.mandelbrot_interior,
+                                      perturbation=(fractals.mandelbrot_step, fractals.mandelbrot_delta_step))
+
+@register_generator("burning_ship", cost=iteration_cost, progress=True, params=FRACTAL_PARAMS)
+def generate_burning_ship(width=256, height=256, max_iter=100, center_x=-0.75, center_y=0, zoom=1, smooth=False, progress=None, **kwargs):
+    """A fiery, jagged, ship-like fractal with flame-like tendrils"""
+    return fractals.escape_time_image(width, height, fractals.burning_ship_step, (center_x, center_y), (3.5, 2.5),
+                                      zoom=zoom, max_iter=max_iter, smooth=smooth, progress=progress,
+                                      perturbation=(fractals.burning_ship_step, fractals.burning_ship_delta_step))
+
+@register_generator("tricorn", cost=iteration_cost, progress=True, params=FRACTAL_PARAMS)
+def generate_tricorn(width=256, height=256, max_iter=100, center_x=-0.25, center_y=0, zoom=1, smooth=False, progress=None, **kwargs):
+    """The Mandelbrot set's mirrored cousin, with three-fold symmetry"""
+    return fractals.escape_time_image(width, height, fractals.tricorn_step, (center_x, center_y), (4, 3),
+                                      zoom=zoom, max_iter=max_iter, smooth=smooth, progress=progress)
+
+@register_generator("multibrot", cost=iteration_cost, progress=True,
+                    params={**FRACTAL_PARAMS, "power": Param(float, 1, 16)})
+def generate_multibrot(width=256, height=256, max_iter=100, power=3, center_x=0, center_y=0, zoom=1, smooth=False, progress=None, **kwargs):
+    """The Mandelbrot set raised to [power]"""
+    # Smooth colouring divides by log(power), and its large bailout is out of
+    # reach of the linearly growing orbits of z + c; use plain counts there.
+    smooth = smooth and power > 1
+    return fractals.escape_time_image(width, height, fractals.multibrot_step(power), (center_x, center_y), (4, 3),
+                                      zoom=zoom, max_iter=max_iter, power=power, smooth=smooth, progress=progress)
+
+@register_generator("julia", cost=iteration_cost, progress=True, params=FRACTAL_PARAMS)
+def generate_julia(width=256, height=256, max_iter=100, c=-0.8+0.156j, center_x=0, center_y=0, zoom=1, smooth=False, progress=None, **kwargs):
+    """The Julia set for the constant [c]"""
+    return fractals.escape_time_image(width, height, fractals.mandelbrot_step, (center_x, center_y), (3.5, 2.5),
+                                      zoom=zoom, max_iter=max_iter, c=c, smooth=smooth, progress=progress)
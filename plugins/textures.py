@@ -0,0 +1,55 @@
+"""Noise"""
+from PIL import Image
+
+from images import SEED, register_generator
+from lazy import LazyModule
+from parameters import Param
+
+np = LazyModule("numpy")
+noise = LazyModule("noise")
+
+SCALE = Param(float, 1, 4096)
+
+@register_generator("white_noise", seeded=True, params={"seed": SEED})
+def generate_white_noise(width, height, seed=None, **kwargs):
+    """Grayscale static, like TV static"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    return Image.fromarray(pixels).convert("RGB")
+
+@register_generator("color_noise", seeded=True, params={"seed": SEED})
+def generate_color_noise(width, height, seed=None, **kwargs):
+    """Random color noise"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+@register_generator("plasma", seeded=True, params={"seed": SEED})
+def generate_plasma(width, height, seed=None, **kwargs):
+    """Wavy colorful noise using sine waves"""
+    rng = np.random.default_rng(seed)
+    x = np.arange(width)[np.newaxis, :]
+    y = np.arange(height)[:, np.newaxis]
+
+    def channel(t):
+        return (127 * (np.sin(t * rng.uniform(0.079, 0.081, (height, width))) + 1)).astype(np.uint8)
+
+    return Image.fromarray(np.dstack([channel(x), channel(y), channel(x + y)]))
+
+@register_generator("value_noise", seeded=True, params={"scale": SCALE, "seed": SEED})
+def generate_value_noise(width=256, height=256, scale=32, seed=None, **kwargs):
+    """Smooth cloudy noise, features [scale] pixels apart"""
+    return noise.to_image(noise.value_noise(width, height, scale, np.random.default_rng(seed)))
+
+@register_generator("perlin", seeded=True, params={"scale": SCALE, "seed": SEED})
+def generate_perlin(width=256, height=256, scale=64, seed=None, **kwargs):
+    """Smoother cloudy noise, features [scale] pixels apart"""
+    return noise.to_image(noise.perlin(width, height, scale, np.random.default_rng(seed)))
+
+@register_generator("fbm", seeded=True, params={"scale": SCALE, "octaves": Param(int, 1, 12),
+                                                "persistence": Param(float, 0, 1),
+                                                "lacunarity": Param(float, 1, 8), "seed": SEED})
+def generate_fbm(width=256, height=256, scale=128, octaves=5, persistence=0.5, lacunarity=2.0, seed=None, **kwargs):
+    """Layered perlin noise, like clouds or terrain"""
+    return noise.to_image(noise.fbm(width, height, scale, np.random.default_rng(seed),
+                                    octaves=octaves, persistence=persistence, lacunarity=lacunarity))
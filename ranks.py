@@ -0,0 +1,52 @@
+from bisect import bisect_left, insort
+
+
+class RankIndex:
+    """Users kept sorted by points, highest first, for leaderboard queries.
+
+    Ties are broken by the order users joined, as storage.list_users lists them.
+    Entries are (-points, order, id) tuples in a sorted list, so ranks are
+    a binary search and a point change only moves one entry.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._users = {}
+        self._next_order = 0
+        self.version = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, users, version=None):
+        self.version = version
+        self._users = {}
+        for order, user in enumerate(users):
+            self._users[str(user['id'])] = (-user['points'], order, user['name'])
+        self._keys = sorted((points, order, user_id) for user_id, (points, order, _) in self._users.items())
+        self._next_order = len(self._keys)
+
+    def set(self, user_id, name, points):
+        user_id = str(user_id)
+        old = self._users.get(user_id)
+        if old is None:
+            order = self._next_order
+            self._next_order += 1
+        else:
+            order = old[1]
+            del self._keys[bisect_left(self._keys, (old[0], order, user_id))]
+        self._users[user_id] = (-points, order, name)
+        insort(self._keys, (-points, order, user_id))
+
+    def rank(self, user_id):
+        """1-based position of the user, counting tied users as equal."""
+        user = self._users.get(str(user_id))
+        if user is None:
+            return None
+        return bisect_left(self._keys, (user[0],)) + 1
+
+    def top(self, count, offset=0):
+        users = []
+        for points, _, user_id in self._keys[offset:offset + max(count, 0)]:
+            users.append({'id': user_id, 'name': self._users[user_id][2], 'points': -points})
+        return users
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+def make_key(name, args, kwargs):
+    """Hash of a render request. Images among the arguments are hashed by
+    content, and kwargs are sorted so their order doesn't matter. `name`
+    should say which code renders it, version included, so entries from
+    before a code change are never served."""
+    h = hashlib.sha256(name.encode())
+    for arg in args:
+        _feed(h, arg)
+    h.update(repr(sorted(kwargs.items())).encode())
+    return h.hexdigest()
+
+
+def _feed(h, arg):
+    if isinstance(arg, Image.Image):
+        h.update(f"image:{arg.mode}:{arg.size}".encode())
+        h.update(arg.tobytes())
+    elif isinstance(arg, (list, tuple)):
+        h.update(f"seq:{len(arg)}".encode())
+        for item in arg:
+            _feed(h, item)
+    else:
+        h.update(repr(arg).encode())
+
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def _write(path, data):
+    # Written whole before it takes the entry's name, so a crash never
+    # leaves a truncated render to be served.
+    with open(path + ".tmp", 'wb') as file:
+        file.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RenderCache:
+    """LRU cache of encoded renders, held in memory and optionally spilled
+    to a directory on disk. Each tier evicts its least recently used entries
+    once it grows past its byte limit."""
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        # Disk reads, writes and removals run one at a time, in the order
+        # they were asked for, off the event loop.
+        self._io = ThreadPoolExecutor(1)
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            entries = []
+            for entry in os.scandir(disk_dir):
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(entries):
+                self._disk[name] = size
+                self._disk_bytes += size
+
+    async def get(self, key):
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+        elif key in self._disk:
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(self._io, _read, self._path(key))
+            except OSError:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            else:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._remember(key, data)
+
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        if self.disk_dir and key not in self._disk and len(data) <= self.disk_max_bytes:
+            self._io.submit(_write, self._path(key), data)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes:
+                old, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._io.submit(_remove, self._path(old))
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import contextlib
+
+
+class Job:
+    def __init__(self, user, guild, cost):
+        self.user = user
+        self.guild = guild
+        self.cost = cost
+        self.admitted = False
+        self.wake = asyncio.Event()
+
+
+class Scheduler:
+    """Admits jobs against a global budget and per-user and per-guild
+    budgets, counted as the total cost of the jobs running under each.
+
+    Waiting users take turns: each pass admits at most one job per user, so
+    a user with a long queue can't starve the others. A job is admitted
+    when it fits under every budget it counts against, or when nothing else
+    is running under one, so a job larger than a budget still runs alone.
+    """
+
+    def __init__(self, budget, user_budget, guild_budget):
+        self.budget = budget
+        self.user_budget = user_budget
+        self.guild_budget = guild_budget
+        self.running = collections.Counter()
+        # Waiting jobs by user, in turn order.
+        self.queues = collections.OrderedDict()
+
+    def _scopes(self, job):
+        scopes = [(None, self.budget), (("user", job.user), self.user_budget)]
+        if job.guild is not None:
+            scopes.append((("guild", job.guild), self.guild_budget))
+        return scopes
+
+    def _fits(self, scope, budget, cost):
+        return not self.running[scope] or self.running[scope] + cost <= budget
+
+    def _dispatch(self):
+        admitted = True
+        while admitted and self.queues:
+            admitted = False
+            for user in [*self.queues]:
+                queue = self.queues[user]
+                job = queue[0]
+                scopes = self._scopes(job)
+                if not self._fits(*scopes[0], job.cost):
+                    # Wait for room rather than let smaller jobs behind
+                    # this one keep taking it.
+                    break
+                if not all(self._fits(scope, budget, job.cost) for scope, budget in scopes[1:]):
+                    continue
+                queue.popleft()
+                for scope, _ in scopes:
+                    self.running[scope] += job.cost
+                job.admitted = True
+                job.wake.set()
+                admitted = True
+                if queue:
+                    self.queues.move_to_end(user)
+                else:
+                    del self.queues[user]
+        for queue in self.queues.values():
+            for job in queue:
+                job.wake.set()
+
+    def position(self, job):
+        """1-based place of a waiting job in the order jobs would be taken."""
+        index = self.queues[job.user].index(job)
+        ahead = index
+        before = True
+        for user, queue in self.queues.items():
+            if user == job.user:
+                before = False
+            else:
+                ahead += min(len(queue), index + before)
+        return ahead + 1
+
+    def waiting(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user, guild, cost, on_wait=None):
+        """Wait for the job's turn and hold its share of the budgets for the
+        duration of the block. `on_wait(position)` is awaited whenever the
+        job's place in the queue changes."""
+        job = Job(user, guild, cost)
+        self.queues.setdefault(user, collections.deque()).append(job)
+        self._dispatch()
+        try:
+            reported = None
+            while not job.admitted:
+                position = self.position(job)
+                if on_wait is not None and position != reported:
+                    reported = position
+                    await on_wait(position)
+                    continue
+                await job.wake.wait()
+                job.wake.clear()
+            yield
+        finally:
+            if job.admitted:
+                for scope, _ in self._scopes(job):
+                    self.running[scope] -= job.cost
+                    if not self.running[scope]:
+                        del self.running[scope]
+            else:
+                queue = self.queues[user]
+                queue.remove(job)
+                if not queue:
+                    del self.queues[user]
+            self._dispatch()
@@ -1,57 +1,43 @@
-import json
 import hashlib
-import os
 
-DB_FILE = 'data.json'
-EXIT = False
+import storage
 
-def load_data():
-    if not os.path.exists(DB_FILE):
-        return []
-    with open(DB_FILE, 'r') as file:
-        return json.load(file)
+DB_FILE = 'data.db'
+LEGACY_DB_FILE = 'data.json'
+EXIT = False
 
-def save_data(data):
-    with open(DB_FILE, 'w') as file:
-        json.dump(data, file, indent=2)
+def find_user(target):
+    return storage.find_user(target, 'id' if len(target) == 64 else 'name')
 
 def add_user(name):
-    data = load_data()
     new_id = hashlib.sha256(name.encode()).hexdigest()
-    data.append({'id': new_id, 'name': name, 'points': 0})
-    save_data(data)
+    storage.add_user(new_id, name)
     print(f'added user {name} ({new_id})')
 
 def get_user(name):
-    data = load_data()
-    s_user = next((user for user in data if user['name'].startswith(name)), None)
+    s_user = storage.find_user(name, 'name')
     if s_user is None:
-        s_user = next((user for user in data if user['id'].startswith(name)), None)
+        s_user = storage.find_user(name, 'id')
     return s_user
 
 def update_user(target, update, new):
-    data = load_data()
-    for user in data:
-        if user['id' if len(target) == 64 else 'name'].startswith(target):
-            if update in user:
-                if type(new) is int:
-                    user[update] = new
-                else:
-                    user[update] = int(new) if new.isdigit() else new
-                print(f'{target}\'s {update} updated to {new}')
-            save_data(data)
-            return True
-    return False
+    user = find_user(target)
+    if user is None:
+        return False
+    if update in user:
+        if type(new) is not int:
+            new = int(new) if new.isdigit() else new
+        storage.update_user(user['id'], update, new)
+        print(f'{target}\'s {update} updated to {new}')
+    return True
 
 def delete_user(user_id):
-    data = load_data()
-    new_data = [user for user in data if not user['id' if len(user_id) == 64 else 'name'].startswith(user_id)]
-    save_data(new_data)
+    while (user := find_user(user_id)) is not None:
+        storage.delete_user(user['id'])
     print(f"{user_id} deleted")
 
 def list_users():
-    data = load_data()
-    for user in data:
+    for user in storage.list_users():
         print(f"{user['name']} ({user['id'][:4]}...) §{user['points']}")
 
 def main():
@@ -96,12 +82,13 @@ def main():
            if len(cmdArgs) > 2 and cmdArgs[2].isdigit():
                user = get_user(cmdArgs[1])
                if user:
-                   user['points'] += int(cmdArgs[2])
-                   update_user(user['id'], 'points', user['points'])
+                   storage.add_points([user['id']], int(cmdArgs[2]))
         elif cmdArgs[0] == 'exit':
             print('bye')
             EXIT = True
 
 if __name__ == "__main__":
+    storage.init(DB_FILE, LEGACY_DB_FILE)
     main()
+    storage.close()
 
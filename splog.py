@@ -0,0 +1,227 @@
+import asyncio
+import datetime
+import glob
+import os
+import re
+import struct
+from dataclasses import dataclass
+
+# Offsets of line starts are stored as little-endian uint64s in a ".idx" file
+# next to each log segment, so line N is one seek into the index and one
+# seek into the log.
+OFFSET = struct.Struct("<Q")
+
+# Once the live log passes this size it is moved to log.log.1, log.log.2, ...
+# and a fresh one is started. Line numbers keep counting across segments.
+MAX_BYTES = 1_000_000
+
+# Records queue up in memory and are written in batches by LogWriter; a full
+# queue makes callers wait instead of dropping entries.
+QUEUE_SIZE = 1000
+FLUSH_INTERVAL = 1.0
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LINE = re.compile(
+    r"(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (?:"
+    r"(?P<actor>\S+) gave (?P<target>\S+) (?P<delta>-?\d+) points"
+    r"|(?P<added>\S+) added to system(?: by (?P<adder>\S+))?"
+    r")(?: \[(?P<guild>.*)\])?$"
+)
+
+
+@dataclass
+class LogRecord:
+    time: datetime.datetime
+    action: str
+    actor: str = None
+    target: str = None
+    delta: int = None
+    guild: str = None
+
+    def format(self):
+        if self.action == "give":
+            text = f"{self.actor} gave {self.target} {self.delta} points"
+        else:
+            text = f"{self.target} added to system"
+            if self.actor:
+                text += f" by {self.actor}"
+        if self.guild:
+            text += f" [{self.guild}]"
+        return self.time.strftime(TIME_FORMAT) + " " + text
+
+    @classmethod
+    def parse(cls, line):
+        match = LINE.match(line)
+        if match is None:
+            return None
+        time = datetime.datetime.strptime(match["time"], TIME_FORMAT)
+        if match["added"]:
+            return cls(time, "add", match["adder"], match["added"], guild=match["guild"])
+        return cls(time, "give", match["actor"], match["target"], int(match["delta"]), match["guild"])
+
+
+class LogFile:
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        for segment in self.segments():
+            if not self._index_ok(segment):
+                self._reindex(segment)
+
+    def segments(self):
+        """Segment paths, oldest first; the live log is last."""
+        archived = []
+        for name in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = name[len(self.path) + 1:]
+            if suffix.isdigit():
+                archived.append((int(suffix), name))
+        return [name for _, name in sorted(archived)] + [self.path]
+
+    def _index_ok(self, segment):
+        index = segment + ".idx"
+        if not os.path.exists(index) or os.path.getsize(index) % OFFSET.size:
+            return False
+        size = os.path.getsize(segment)
+        count = os.path.getsize(index) // OFFSET.size
+        if count == 0:
+            return size == 0
+        with open(index, 'rb') as idx, open(segment, 'rb') as log:
+            idx.seek((count - 1) * OFFSET.size)
+            log.seek(OFFSET.unpack(idx.read(OFFSET.size))[0])
+            log.readline()
+            return log.tell() == size
+
+    def _reindex(self, segment):
+        with open(segment, 'rb') as log, open(segment + ".idx", 'wb') as idx:
+            offset = 0
+            for line in log:
+                idx.write(OFFSET.pack(offset))
+                offset += len(line)
+
+    def _count(self, segment):
+        return os.path.getsize(segment + ".idx") // OFFSET.size
+
+    def count(self):
+        return sum(self._count(segment) for segment in self.segments())
+
+    def append(self, text):
+        self.append_many([text])
+
+    def append_many(self, texts):
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+        offsets = []
+        with open(self.path, 'ab') as log:
+            offset = log.tell()
+            for text in texts:
+                data = (text.replace("\n", " ") + "\n").encode()
+                offsets.append(OFFSET.pack(offset))
+                offset += len(data)
+                log.write(data)
+        with open(self.path + ".idx", 'ab') as idx:
+            idx.write(b"".join(offsets))
+
+    def rotate(self):
+        archived = len(self.segments())
+        target = f"{self.path}.{archived}"
+        os.replace(self.path, target)
+        os.replace(self.path + ".idx", target + ".idx")
+        open(self.path, 'wb').close()
+        open(self.path + ".idx", 'wb').close()
+
+    def lines(self, start=1, stop=None):
+        """Yield (number, line) for lines start..stop inclusive, 1-based."""
+        first = 1
+        for segment in self.segments():
+            count = self._count(segment)
+            last = first + count - 1
+            if stop is not None and first > stop:
+                return
+            if last >= start and count:
+                skip = max(start - first, 0)
+                with open(segment + ".idx", 'rb') as idx, open(segment, 'rb') as log:
+                    idx.seek(skip * OFFSET.size)
+                    log.seek(OFFSET.unpack(idx.read(OFFSET.size))[0])
+                    number = first + skip
+                    for line in log:
+                        if stop is not None and number > stop:
+                            return
+                        yield number, line.decode(errors="replace").rstrip("\n")
+                        number += 1
+            first = last + 1
+
+    def line(self, number):
+        for _, line in self.lines(number, number):
+            return line
+        return None
+
+    def latest(self):
+        count = self.count()
+        return self.line(count) if count else None
+
+    def search(self, start=1, stop=None, user=None, actor=None, target=None):
+        """Yield (number, line) for lines whose record matches every filter
+        given; `user` matches either the actor or the target."""
+        for number, line in self.lines(start, stop):
+            record = LogRecord.parse(line)
+            if record is None:
+                continue
+            if user is not None and user not in (record.actor, record.target):
+                continue
+            if actor is not None and record.actor != actor:
+                continue
+            if target is not None and record.target != target:
+                continue
+            yield number, line
+
+
+class LogWriter:
+    """Queues LogRecords and appends them to a LogFile from a background
+    task, in batches and off the event loop."""
+
+    def __init__(self, log, queue_size=QUEUE_SIZE, interval=FLUSH_INTERVAL):
+        self.log = log
+        self.interval = interval
+        self.queue = asyncio.Queue(queue_size)
+        self._task = None
+        self._batch = []
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, record):
+        await self.queue.put(record)
+
+    async def flush(self):
+        """Wait until everything queued so far has been written."""
+        if self._task is None:
+            self.drain()
+        else:
+            await self.queue.join()
+
+    async def _run(self):
+        while True:
+            self._batch.append(await self.queue.get())
+            await asyncio.sleep(self.interval)
+            while not self.queue.empty():
+                self._batch.append(self.queue.get_nowait())
+            # Once handed to the thread a batch is written even if this task
+            # is cancelled, so it no longer counts as pending.
+            batch, self._batch = self._batch, []
+            try:
+                await asyncio.to_thread(self.log.append_many, [record.format() for record in batch])
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def drain(self):
+        """Synchronously write whatever is still queued, e.g. on shutdown."""
+        batch, self._batch = self._batch, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        for _ in batch:
+            self.queue.task_done()
+        if batch:
+            self.log.append_many([record.format() for record in batch])
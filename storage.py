@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+
+FIELDS = ("id", "name", "points")
+
+# Number of pending writes after which a UserCache flushes on its own.
+FLUSH_SIZE = 100
+
+_db = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    points INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_points ON users (points DESC);
+"""
+
+
+def init(path, legacy_json=None):
+    """Open the database at `path`, creating it if needed.
+
+    If `legacy_json` names an old JSON user list it is imported once and then
+    renamed so it is never imported again.
+    """
+    global _db
+    _db = sqlite3.connect(path, timeout=5)
+    _db.row_factory = sqlite3.Row
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db.execute("PRAGMA synchronous=NORMAL")
+    _db.executescript(SCHEMA)
+
+    if legacy_json and os.path.exists(legacy_json):
+        migrate_json(legacy_json)
+        os.replace(legacy_json, legacy_json + ".migrated")
+
+
+def migrate_json(path):
+    with open(path, 'r') as file:
+        data = json.load(file)
+    with _db:
+        _db.executemany(
+            "INSERT OR IGNORE INTO users (id, name, points) VALUES (?, ?, ?)",
+            [(str(user['id']), user['name'], user['points']) for user in data],
+        )
+    return len(data)
+
+
+def close():
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+
+
+def find_user(prefix, field="name"):
+    if field not in ("id", "name"):
+        raise ValueError(f"Cannot search users by {field}")
+    row = _db.execute(
+        f"SELECT id, name, points FROM users WHERE substr({field}, 1, ?) = ? ORDER BY rowid LIMIT 1",
+        (len(prefix), prefix),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def add_user(user_id, name, points=0):
+    with _db:
+        cur = _db.execute(
+            "INSERT OR IGNORE INTO users (id, name, points) VALUES (?, ?, ?)",
+            (str(user_id), name, points),
+        )
+    return cur.rowcount == 1
+
+
+def update_user(user_id, field, value):
+    if field not in FIELDS:
+        raise ValueError(f"Unknown user field {field}")
+    with _db:
+        cur = _db.execute(f"UPDATE users SET {field} = ? WHERE id = ?", (value, str(user_id)))
+    return cur.rowcount == 1
+
+
+def add_points(user_ids, delta):
+    """Atomically add `delta` to the points of every user in `user_ids`.
+
+    All updates happen in one transaction; if any user does not exist none
+    are applied and KeyError is raised with that id. Returns the new totals
+    keyed by user id.
+    """
+    totals = {}
+    with _db:
+        for user_id in user_ids:
+            row = _db.execute(
+                "UPDATE users SET points = points + ? WHERE id = ? RETURNING points", (delta, str(user_id))
+            ).fetchone()
+            if row is None:
+                raise KeyError(str(user_id))
+            totals[str(user_id)] = row[0]
+    return totals
+
+
+def delete_user(user_id):
+    with _db:
+        cur = _db.execute("DELETE FROM users WHERE id = ?", (str(user_id),))
+    return cur.rowcount == 1
+
+
+def list_users():
+    return [dict(row) for row in _db.execute("SELECT id, name, points FROM users ORDER BY rowid")]
+
+
+def write_batch(new_users, deltas):
+    """Apply queued writes in one transaction: inserts of `new_users`
+    (id -> name), then point increments (id -> delta)."""
+    with _db:
+        _db.executemany(
+            "INSERT OR IGNORE INTO users (id, name, points) VALUES (?, ?, 0)", new_users.items()
+        )
+        _db.executemany(
+            "UPDATE users SET points = points + ? WHERE id = ?",
+            [(delta, user_id) for user_id, delta in deltas.items()],
+        )
+
+
+def data_version():
+    # Changes whenever another connection (e.g. sigma-db.py) commits.
+    return _db.execute("PRAGMA data_version").fetchone()[0]
+
+
+
+class UserCache:
+    """Write-behind cache of the users table.
+
+    Reads are served from memory. Writes change the cached users at once and
+    are queued until flush(), which writes them all in one transaction; it
+    runs by itself once FLUSH_SIZE writes are pending. When another
+    connection commits, the cache reloads the table and replays the pending
+    writes on top, so point changes made elsewhere are never overwritten.
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE):
+        self.flush_size = flush_size
+        self.generation = 0
+        self._users = {}
+        self._version = None
+        self._new = {}
+        self._deltas = {}
+
+    def refresh(self):
+        version = data_version()
+        if version == self._version:
+            return False
+
+        self._users = {user['id']: user for user in list_users()}
+        for user_id, name in self._new.items():
+            self._users.setdefault(user_id, {'id': user_id, 'name': name, 'points': 0})
+        for user_id, delta in self._deltas.items():
+            if user_id in self._users:
+                self._users[user_id]['points'] += delta
+
+        self._version = version
+        self.generation += 1
+        return True
+
+    def pending(self):
+        return len(self._new) + len(self._deltas)
+
+    def flush(self):
+        if not self.pending():
+            return
+        write_batch(self._new, self._deltas)
+        self._new, self._deltas = {}, {}
+
+    def _written(self):
+        if self.pending() >= self.flush_size:
+            self.flush()
+
+    def get(self, user_id):
+        self.refresh()
+        user = self._users.get(str(user_id))
+        return dict(user) if user else None
+
+    def list(self):
+        self.refresh()
+        return [dict(user) for user in self._users.values()]
+
+    def add(self, user_id, name):
+        self.refresh()
+        user_id = str(user_id)
+        if user_id in self._users:
+            return False
+        self._users[user_id] = {'id': user_id, 'name': name, 'points': 0}
+        self._new[user_id] = name
+        self._written()
+        return True
+
+    def add_points(self, user_ids, delta):
+        """Same contract as storage.add_points, applied to the cache."""
+        self.refresh()
+        user_ids = [str(user_id) for user_id in user_ids]
+        for user_id in user_ids:
+            if user_id not in self._users:
+                raise KeyError(user_id)
+
+        totals = {}
+        for user_id in user_ids:
+            self._users[user_id]['points'] += delta
+            self._deltas[user_id] = self._deltas.get(user_id, 0) + delta
+            totals[user_id] = self._users[user_id]['points']
+        self._written()
+        return totals
@@ -0,0 +1,265 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+
+# Workers are forked from a spawner process, itself forked when the pool is
+# created at startup: before the bot has started threads or opened its
+# database, but after it has registered its plugins. Workers inherit those,
+# so jobs only need to pickle the function by name, and never a lock some
+# thread in the bot happened to hold. Whatever the bot hasn't imported yet, a
+# worker imports on its first job that needs it.
+
+# Jobs that report progress send at most one update per PROGRESS_INTERVAL.
+PROGRESS_INTERVAL = 0.25
+
+# Set in each worker to its share of the cores.
+_threads = None
+
+
+def threads():
+    """How many threads a job may use: the process's share of the cores when
+    it runs in a worker, all of them otherwise."""
+    return _threads or os.cpu_count() or 1
+
+
+class _Progress:
+    """Passed to jobs as `progress`; sends the fraction done so far back to
+    the parent. Safe to call from several threads."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.sent = 0.0
+
+    def __call__(self, fraction):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.sent >= PROGRESS_INTERVAL:
+                self.sent = now
+                self.conn.send(("progress", fraction))
+
+
+def _worker_main(conn, threads):
+    global _threads
+    _threads = threads
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        func, args, kwargs, progress = job
+        if progress:
+            kwargs["progress"] = _Progress(conn)
+        try:
+            reply = ("result", True, func(*args, **kwargs))
+        except Exception as e:
+            reply = ("result", False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send(("result", False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+def _spawner_main(conn):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Nothing waits for the workers here; let the kernel reap them.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            kind, arg = conn.recv()
+        except EOFError:
+            return
+
+        if kind == "spawn":
+            parent_conn, child_conn = multiprocessing.Pipe()
+            pid = os.fork()
+            if pid == 0:
+                conn.close()
+                parent_conn.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                try:
+                    _worker_main(child_conn, arg)
+                finally:
+                    os._exit(0)
+            child_conn.close()
+            conn.send(pid)
+            reduction.send_handle(conn, parent_conn.fileno(), os.getppid())
+            parent_conn.close()
+        elif kind == "prepare":
+            try:
+                arg()
+                conn.send((True, None))
+            except Exception as e:
+                conn.send((False, e))
+
+
+class _Spawner:
+    """Forks the spawner process and asks it for workers."""
+
+    # A spawner only sees EOF once every copy of the bot's end is closed, so
+    # spawners forked later close the earlier ones' ends they inherited.
+    _open = []
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            self.conn.close()
+            for other in self._open:
+                other.conn.close()
+            try:
+                _spawner_main(child_conn)
+            finally:
+                os._exit(0)
+        child_conn.close()
+        self._open.append(self)
+
+    def spawn(self, threads):
+        """Return the pid of a new worker that may use `threads` threads and
+        a connection to it."""
+        self.conn.send(("spawn", threads))
+        pid = self.conn.recv()
+        return pid, Connection(reduction.recv_handle(self.conn))
+
+    def prepare(self, func):
+        """Call func() in the spawner, so workers forked from now on see
+        what it did."""
+        self.conn.send(("prepare", func))
+        ok, error = self.conn.recv()
+        if not ok:
+            raise error
+
+    def close(self):
+        self._open.remove(self)
+        self.conn.close()
+        os.waitpid(self.pid, 0)
+
+
+class Worker:
+    def __init__(self, spawner, threads, generation=0):
+        self.generation = generation
+        self.pid, self.conn = spawner.spawn(threads)
+
+    async def call(self, func, args, kwargs, progress=None):
+        """Send a job and wait for its (ok, result), passing any progress
+        updates on to `progress` along the way."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = self.conn.fileno()
+
+        self.conn.send((func, args, kwargs, progress is not None))
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                while self.conn.poll():
+                    try:
+                        kind, *message = self.conn.recv()
+                    except EOFError:
+                        raise RuntimeError("Worker process exited unexpectedly") from None
+                    if kind == "result":
+                        return message
+                    progress(*message)
+        finally:
+            loop.remove_reader(fd)
+
+    def alive(self):
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def join(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.alive():
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(0.001)
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.join(1)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.join(1)
+        self.kill()
+
+
+class WorkerPool:
+    def __init__(self, size=None, timeout=None):
+        self.size = size or os.cpu_count() or 1
+        self.threads = max(1, (os.cpu_count() or 1) // self.size)
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+        self._generation = 0
+        self._spawner = _Spawner()
+
+    async def run(self, func, args=(), kwargs=None, timeout=None, progress=None):
+        """Run func(*args, **kwargs) in a worker process.
+
+        If the job exceeds its timeout or the awaiting task is cancelled the
+        worker running it is killed and replaced, so it never holds a slot.
+        With `progress` set, the job is also given a `progress` callable and
+        whatever it reports is passed to `progress` in this process.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        timeout = timeout if timeout is not None else self.timeout
+
+        async with self._slots:
+            worker = self._idle.pop() if self._idle else Worker(self._spawner, self.threads, self._generation)
+            try:
+                ok, result = await asyncio.wait_for(worker.call(func, args, kwargs or {}, progress), timeout)
+            except BaseException:
+                worker.kill()
+                raise
+
+            if not worker.alive():
+                worker.kill()
+            elif worker.generation != self._generation:
+                worker.stop()
+            else:
+                self._idle.append(worker)
+
+        if not ok:
+            raise result
+        return result
+
+    def restart(self, prepare=None):
+        """Replace the workers, e.g. after reloading modules their jobs run.
+        `prepare`, if given, is called in the spawner first so the new
+        workers inherit what it does. Idle workers stop now and busy ones
+        once their job is done."""
+        if prepare is not None:
+            self._spawner.prepare(prepare)
+        self._generation += 1
+        self._stop_idle()
+
+    def _stop_idle(self):
+        while self._idle:
+            self._idle.pop().stop()
+
+    def shutdown(self):
+        self._stop_idle()
+        self._spawner.close()